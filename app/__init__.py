@@ -23,6 +23,12 @@ def create_app(config_class=Config):
     migrate.init_app(app, db)
     bcrypt.init_app(app)
     
+    from app.services.cache import shared_cache
+    shared_cache.init_app(app)
+    
+    from app.services.heartbeats import heartbeat_buffer
+    heartbeat_buffer.init_app(app)
+    
     # Configure login manager
     login_manager.login_view = 'auth.login'
     login_manager.login_message_category = 'info'
@@ -44,6 +50,10 @@ def create_app(config_class=Config):
     from app.routes.api import bp as api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
     
+    # Register maintenance commands
+    from app.cli import register_commands
+    register_commands(app)
+    
     return app
 
 @login_manager.user_loader
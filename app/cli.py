@@ -0,0 +1,180 @@
+"""Maintenance commands, available through ``flask <command>``"""
+
+import click
+from flask.cli import with_appcontext
+
+from app import db
+
+
+@click.command('sync-achievements')
+@click.option('--chunk-size', default=500, show_default=True, help='Users per transaction')
+@with_appcontext
+def sync_achievements_command(chunk_size):
+    """Recount lesson/quiz counters and award any missing achievements"""
+    from app.models.user import User, UserProgress
+    from app.models.course import Question, QuizAttempt
+    from app.services.achievements import sync_achievements
+    from config import Config
+
+    lesson_counts = dict(
+        db.session.query(UserProgress.user_id, db.func.count(UserProgress.id))
+        .filter(UserProgress.completed.is_(True))
+        .group_by(UserProgress.user_id)
+    )
+
+    question_counts = (
+        db.session.query(Question.quiz_id, db.func.count(Question.id).label('total'))
+        .group_by(Question.quiz_id)
+        .subquery()
+    )
+    passed_counts = dict(
+        db.session.query(QuizAttempt.user_id, db.func.count(QuizAttempt.id))
+        .join(question_counts, question_counts.c.quiz_id == QuizAttempt.quiz_id)
+        .filter(QuizAttempt.score * 100 >= question_counts.c.total * Config.QUIZ_PASS_PERCENTAGE)
+        .group_by(QuizAttempt.user_id)
+    )
+
+    awarded = 0
+    last_id = 0
+    while True:
+        users = User.query.filter(User.id > last_id).order_by(User.id).limit(chunk_size).all()
+        if not users:
+            break
+        for user in users:
+            user.lessons_completed = lesson_counts.get(user.id, 0)
+            user.quizzes_passed = passed_counts.get(user.id, 0)
+            awarded += len(sync_achievements(user))
+        db.session.commit()
+        last_id = users[-1].id
+
+    click.echo(f'Awarded {awarded} missing achievements')
+
+
+@click.command('rebuild-points')
+@click.option('--chunk-size', default=1000, show_default=True, help='Users per transaction')
+@click.option('--seed-opening-balances', is_flag=True,
+              help='First record existing totals that have no ledger events')
+@with_appcontext
+def rebuild_points_command(chunk_size, seed_opening_balances):
+    """Recompute cached total_points and level from the points ledger"""
+    from app.services.points import rebuild_totals, seed_opening_balances as seed
+
+    if seed_opening_balances:
+        seeded = seed()
+        db.session.commit()
+        click.echo(f'Seeded opening balances for {seeded} users')
+
+    changed = rebuild_totals(chunk_size)
+    click.echo(f'Updated {changed} users')
+
+
+@click.command('rebuild-score-buckets')
+@with_appcontext
+def rebuild_score_buckets_command():
+    """Rebuild the daily per-course leaderboard buckets from the points ledger"""
+    from app.services.leaderboard import rebuild_score_buckets
+
+    count = rebuild_score_buckets()
+    db.session.commit()
+    click.echo(f'Rebuilt {count} score buckets')
+
+
+@click.command('recompute-levels')
+@click.option('--chunk-size', default=5000, show_default=True, help='Users per transaction')
+@with_appcontext
+def recompute_levels_command(chunk_size):
+    """Recompute every user's level from the configured level curve"""
+    from app.services.levels import recompute_levels
+
+    stats = recompute_levels(chunk_size)
+    click.echo(
+        f"Scanned {stats['users']} users, updated {stats['changed']} "
+        f"in {stats['seconds']:.2f}s ({stats['users_per_second']:.0f} users/s)"
+    )
+
+
+@click.command('cache-stats')
+@with_appcontext
+def cache_stats_command():
+    """Show shared cache hit/miss counters, summed across workers"""
+    from app.services.cache import shared_cache
+
+    for namespace, counts in sorted(shared_cache.stats().items()):
+        click.echo(f"{namespace}: {counts['hits']} hits, {counts['misses']} misses "
+                   f"({counts['hit_rate']:.1%} hit rate)")
+
+
+@click.command('reset-streaks')
+@click.option('--chunk-size', default=5000, show_default=True, help='Users per transaction')
+@click.option('--rebuild', is_flag=True, help='Recompute every streak from the activity bitmaps')
+@with_appcontext
+def reset_streaks_command(chunk_size, rebuild):
+    """Nightly job: zero the streaks of users who missed a day"""
+    from app.services.streaks import rebuild_streaks, reset_broken_streaks
+
+    if rebuild:
+        click.echo(f'Rebuilt streaks for {rebuild_streaks(chunk_size)} users')
+    click.echo(f'Reset {reset_broken_streaks(chunk_size)} broken streaks')
+
+
+@click.command('reconcile-enrollments')
+@click.option('--chunk-size', default=1000, show_default=True, help='Enrollments per transaction')
+@with_appcontext
+def reconcile_enrollments_command(chunk_size):
+    """Recount the completed/total lesson counters on every enrollment"""
+    from app.services.progress import reconcile_enrollments
+
+    click.echo(f'Corrected {reconcile_enrollments(chunk_size)} enrollments')
+
+
+@click.command('backfill-course-completions')
+@click.option('--chunk-size', default=1000, show_default=True, help='Enrollments per transaction')
+@with_appcontext
+def backfill_course_completions_command(chunk_size):
+    """Mark finished enrollments as completed and award course achievements"""
+    from app.services.progress import backfill_course_completions
+
+    click.echo(f'Marked {backfill_course_completions(chunk_size)} enrollments as completed')
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Rebuild the configured search backend's index from courses and lessons"""
+    from app.services.search_backends import get_backend
+
+    backend = get_backend()
+    click.echo(f'Indexed {backend.rebuild()} documents ({backend.name} backend)')
+
+
+@click.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              help='File format (default: from the file extension)')
+@click.option('--chunk-size', default=500, show_default=True, help='Users per transaction')
+@click.option('--workers', type=int, help='Password hashing processes (default: one per CPU)')
+@with_appcontext
+def import_users_command(path, fmt, chunk_size, workers):
+    """Create users and course enrollments from a CSV or NDJSON file"""
+    from app.services.provisioning import format_for_filename, import_users, parse_import
+
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows, errors = parse_import(f, fmt or format_for_filename(path))
+    stats = import_users(rows, chunk_size, workers)
+    for line, message in sorted(errors + stats['errors']):
+        click.echo(f'line {line}: {message}', err=True)
+    click.echo(f"Created {stats['created']} users, matched {stats['existing']} existing users, "
+               f"added {stats['enrollments']} enrollments")
+
+
+def register_commands(app):
+    app.cli.add_command(sync_achievements_command)
+    app.cli.add_command(rebuild_points_command)
+    app.cli.add_command(rebuild_score_buckets_command)
+    app.cli.add_command(recompute_levels_command)
+    app.cli.add_command(cache_stats_command)
+    app.cli.add_command(reset_streaks_command)
+    app.cli.add_command(reconcile_enrollments_command)
+    app.cli.add_command(backfill_course_completions_command)
+    app.cli.add_command(import_users_command)
+    app.cli.add_command(rebuild_search_index_command)
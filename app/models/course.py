@@ -15,6 +15,37 @@ class Course(db.Model):
 
     def __repr__(self):
         return f'<Course {self.title}>'
+    
+    @staticmethod
+    def attach_counts(courses):
+        """Set lesson_count, quiz_count and enrollment_count on each course with one query"""
+        from app.models.user import Enrollment
+        courses = list(courses)
+        if not courses:
+            return courses
+        course_ids = [course.id for course in courses]
+        
+        def grouped(model):
+            return db.session.query(
+                model.course_id, db.func.count(model.id).label('n')
+            ).filter(model.course_id.in_(course_ids)).group_by(model.course_id).subquery()
+        
+        lessons, quizzes, enrollments = grouped(Lesson), grouped(Quiz), grouped(Enrollment)
+        rows = db.session.query(
+            Course.id,
+            db.func.coalesce(lessons.c.n, 0),
+            db.func.coalesce(quizzes.c.n, 0),
+            db.func.coalesce(enrollments.c.n, 0)
+        ).outerjoin(lessons, lessons.c.course_id == Course.id) \
+         .outerjoin(quizzes, quizzes.c.course_id == Course.id) \
+         .outerjoin(enrollments, enrollments.c.course_id == Course.id) \
+         .filter(Course.id.in_(course_ids))
+        counts = {course_id: (n_lessons, n_quizzes, n_enrollments)
+                  for course_id, n_lessons, n_quizzes, n_enrollments in rows}
+        
+        for course in courses:
+            course.lesson_count, course.quiz_count, course.enrollment_count = counts.get(course.id, (0, 0, 0))
+        return courses
 
 class Lesson(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -1,3 +1,4 @@
+from collections import namedtuple
 from datetime import datetime
 from app import db
 
@@ -13,6 +14,10 @@ class Achievement(db.Model):
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(255), nullable=False)
     icon = db.Column(db.String(50), default='fa-award')
+    
+    # Award criteria: a metric name (see app.services.achievements.METRICS) and the value to reach
+    criteria_metric = db.Column(db.String(30))
+    criteria_threshold = db.Column(db.Integer)
 
 class UserAchievement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -22,9 +27,105 @@ class UserAchievement(db.Model):
 
     achievement = db.relationship('Achievement', backref=db.backref('user_achievements', lazy='dynamic'))
 
+class PointsEvent(db.Model):
+    """Append-only ledger of every points award"""
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    source_type = db.Column(db.String(30), nullable=False)  # lesson, quiz, challenge, adjustment, opening_balance
+    source_id = db.Column(db.Integer)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
+    points = db.Column(db.Integer, nullable=False)
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (db.Index('ix_points_event_user_created', 'user_id', 'created_at'),)
+    
+    def __repr__(self):
+        return f'<PointsEvent User:{self.user_id} {self.source_type}:{self.source_id} {self.points:+d}>'
+
+class ScoreBucket(db.Model):
+    """Points earned by a user on one day, per course (course_id 0 when not course-specific)"""
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    course_id = db.Column(db.Integer, nullable=False, default=0)
+    points = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', 'course_id', name='unique_score_bucket'),
+        db.Index('ix_score_bucket_day_course', 'day', 'course_id'),
+        db.Index('ix_score_bucket_course_day', 'course_id', 'day'),
+    )
+
+LeaderboardEntry = namedtuple('LeaderboardEntry', 'id username full_name level points rank achievements_count')
+
 class LeaderboardView:
     @staticmethod
-    def top_users(limit=10):
+    def _load_users(user_ids):
+        """Load users in the given order, with ``achievements_count`` set, in one query"""
         from app.models.user import User
-        return User.query.order_by(User.total_points.desc()).limit(limit).all()
+        if not user_ids:
+            return []
+        counts = db.session.query(
+            UserAchievement.user_id,
+            db.func.count(UserAchievement.id).label('achievements_count')
+        ).filter(UserAchievement.user_id.in_(user_ids)).group_by(UserAchievement.user_id).subquery()
+        rows = db.session.query(User, db.func.coalesce(counts.c.achievements_count, 0)).outerjoin(
+            counts, counts.c.user_id == User.id
+        ).filter(User.id.in_(user_ids)).all()
+        users = {}
+        for user, achievements_count in rows:
+            user.achievements_count = achievements_count
+            users[user.id] = user
+        return [users[user_id] for user_id in user_ids if user_id in users]
+
+    @staticmethod
+    def top_users(limit=10, window=None, course_id=None):
+        """Top users for lifetime points, or for a time window and/or course.
+        
+        Each returned user has ``leaderboard_points`` set to the points the
+        ranking was computed from, and ``achievements_count`` populated.
+        """
+        from app.services.leaderboard import WINDOWS, get_rank_index, window_top
+        if window in WINDOWS or course_id:
+            top = window_top(window, course_id, limit)
+        else:
+            top = get_rank_index().top(limit)
+        points = dict(top)
+        users = LeaderboardView._load_users([user_id for user_id, _ in top])
+        for user in users:
+            user.leaderboard_points = points[user.id]
+        return users
 
+    @staticmethod
+    def snapshot(limit=10, window=None, course_id=None):
+        """Cached, render-ready version of ``top_users`` as LeaderboardEntry rows"""
+        from app.services.cache import shared_cache
+        from app.services.leaderboard import snapshot_key
+        from config import Config
+        
+        key = snapshot_key(window, course_id, limit)
+        cached = shared_cache.get(key)
+        if cached is not None:
+            return [LeaderboardEntry(*row) for row in cached]
+        
+        entries = [
+            LeaderboardEntry(user.id, user.username, user.full_name, user.level,
+                             user.leaderboard_points, rank, user.achievements_count)
+            for rank, user in enumerate(LeaderboardView.top_users(limit, window, course_id), start=1)
+        ]
+        # A partial board can be entered by anyone, so its floor is zero
+        floor = entries[-1].points if len(entries) >= limit else 0
+        shared_cache.set(key, [list(entry) for entry in entries], Config.LEADERBOARD_CACHE_TTL,
+                         floor=floor, scope=course_id or None)
+        return entries
+
+    @staticmethod
+    def user_rank(user, window=None, course_id=None):
+        """The user's rank on the same board ``top_users`` would return"""
+        from app.services.leaderboard import WINDOWS, window_rank
+        if window in WINDOWS or course_id:
+            return window_rank(user.id, window, course_id)[0]
+        return user.get_leaderboard_rank()
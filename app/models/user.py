@@ -1,8 +1,10 @@
-from datetime import datetime
+from bisect import bisect_right
+from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db, login_manager
+from config import Config
 
 class User(UserMixin, db.Model):
     """User model for authentication and user management"""
@@ -33,6 +35,11 @@ class User(UserMixin, db.Model):
     level = db.Column(db.Integer, default=1)
     streak_days = db.Column(db.Integer, default=0)
     last_activity = db.Column(db.DateTime)
+    last_active_on = db.Column(db.Date)
+    lessons_completed = db.Column(db.Integer, default=0)
+    quizzes_passed = db.Column(db.Integer, default=0)
+    courses_completed = db.Column(db.Integer, default=0)
+    stats_version = db.Column(db.Integer, default=0)  # bumped whenever gamification stats change
     
     # Relationships
     enrollments = db.relationship('Enrollment', backref='user', lazy='dynamic', cascade='all, delete-orphan')
@@ -56,42 +63,75 @@ class User(UserMixin, db.Model):
         """Get user's full name"""
         return f"{self.first_name} {self.last_name}"
     
+    @staticmethod
+    def level_for_points(points, thresholds=None):
+        """Calculate level for a points total from the level curve (computed on each call)"""
+        if thresholds is None:
+            thresholds = Config.LEVEL_THRESHOLDS
+        return max(bisect_right(thresholds, points or 0), 1)
+    
     def get_level(self):
         """Calculate user level based on points"""
-        if self.total_points < 100:
-            return 1
-        elif self.total_points < 500:
-            return 2
-        elif self.total_points < 1500:
-            return 3
-        elif self.total_points < 3000:
-            return 4
-        else:
-            return 5
+        return User.level_for_points(self.total_points)
     
     def get_level_progress(self):
         """Get progress to next level as percentage"""
-        level_thresholds = [0, 100, 500, 1500, 3000, 10000]
+        level_thresholds = Config.LEVEL_THRESHOLDS
         current_level = self.get_level()
         
-        if current_level >= 5:
+        if current_level >= len(level_thresholds):
             return 100
         
         current_threshold = level_thresholds[current_level - 1]
         next_threshold = level_thresholds[current_level]
         
-        progress = ((self.total_points - current_threshold) / (next_threshold - current_threshold)) * 100
+        progress = (((self.total_points or 0) - current_threshold) / (next_threshold - current_threshold)) * 100
         return min(progress, 100)
     
-    def add_points(self, points):
-        """Add points to user and update level"""
-        self.total_points += points
-        self.level = self.get_level()
-        self.last_activity = datetime.utcnow()
+    def add_points(self, points, source_type='adjustment', source_id=None, idempotency_key=None, course_id=None):
+        """Record points in the ledger and update total and level, returning (old, new) points"""
+        from app.services.points import award_points
+        return award_points(self, points, source_type, source_id, idempotency_key, course_id)
+    
+    def _increment_counter(self, column):
+        """Atomically increment a counter column, returning (old, new)"""
+        from sqlalchemy.orm.attributes import set_committed_value
+        attr = getattr(User, column)
+        db.session.execute(
+            db.update(User).where(User.id == self.id).values({attr: db.func.coalesce(attr, 0) + 1})
+        )
+        new_count = db.session.query(attr).filter(User.id == self.id).scalar()
+        set_committed_value(self, column, new_count)
+        return new_count - 1, new_count
+    
+    def record_lesson_completed(self):
+        """Increment the completed lessons counter, returning (old, new)"""
+        return self._increment_counter('lessons_completed')
+    
+    def record_quiz_passed(self):
+        """Increment the passed quizzes counter, returning (old, new)"""
+        return self._increment_counter('quizzes_passed')
+    
+    def record_course_completed(self):
+        """Increment the completed courses counter, returning (old, new)"""
+        return self._increment_counter('courses_completed')
+    
+    def bump_stats_version(self):
+        """Mark cached copies of this user's stats (ETags) as stale"""
+        return self._increment_counter('stats_version')[1]
+    
+    @property
+    def current_streak(self):
+        """Streak in days, treating a streak with no activity since yesterday as broken"""
+        from app.services.streaks import streak_is_alive
+        return (self.streak_days or 0) if streak_is_alive(self.last_active_on) else 0
     
     def get_achievements(self):
-        """Get user's achievements"""
-        return [ua.achievement for ua in self.achievements.all()]
+        """Get user's achievements, most recently earned first"""
+        from app.models.gamification import Achievement, UserAchievement
+        return Achievement.query.join(UserAchievement).filter(
+            UserAchievement.user_id == self.id
+        ).order_by(UserAchievement.earned_at.desc()).all()
     
     def has_achievement(self, achievement_id):
         """Check if user has specific achievement"""
@@ -99,25 +139,13 @@ class User(UserMixin, db.Model):
     
     def get_course_progress(self, course_id):
         """Get user's progress in a specific course"""
-        from app.models.course import Course
-        course = Course.query.get(course_id)
-        if not course:
-            return 0
-        
-        total_lessons = len(course.lessons)
-        if total_lessons == 0:
-            return 0
-        
-        completed_lessons = self.user_progress.filter_by(
-            lesson_id=db.any_([lesson.id for lesson in course.lessons]),
-            completed=True
-        ).count()
-        
-        return (completed_lessons / total_lessons) * 100
+        from app.services.progress import get_progress_for_courses
+        return get_progress_for_courses(self, [course_id])[course_id].percentage
     
     def get_leaderboard_rank(self):
         """Get user's rank on leaderboard"""
-        return User.query.filter(User.total_points > self.total_points).count() + 1
+        from app.services.leaderboard import get_rank_index
+        return get_rank_index().rank(self.id, self.total_points)
     
     def to_dict(self):
         """Convert user to dictionary"""
@@ -142,6 +170,10 @@ class Enrollment(db.Model):
     completed_at = db.Column(db.DateTime)
     is_completed = db.Column(db.Boolean, default=False)
     
+    # Denormalized progress counters, kept in step by app.services.progress
+    completed_lessons = db.Column(db.Integer, default=0, nullable=False)
+    total_lessons = db.Column(db.Integer, default=0, nullable=False)
+    
     __table_args__ = (db.UniqueConstraint('user_id', 'course_id', name='unique_enrollment'),)
     
     def __repr__(self):
@@ -149,18 +181,9 @@ class Enrollment(db.Model):
     
     def get_progress_percentage(self):
         """Get enrollment progress as percentage"""
-        from app.models.course import Lesson
-        
-        course_lessons = Lesson.query.filter_by(course_id=self.course_id).all()
-        if not course_lessons:
+        if not self.total_lessons:
             return 0
-        
-        completed_lessons = UserProgress.query.filter_by(
-            user_id=self.user_id,
-            completed=True
-        ).filter(UserProgress.lesson_id.in_([lesson.id for lesson in course_lessons])).count()
-        
-        return (completed_lessons / len(course_lessons)) * 100
+        return min(self.completed_lessons / self.total_lessons, 1) * 100
 
 class UserProgress(db.Model):
     """Track user progress through lessons"""
@@ -184,6 +207,45 @@ class UserProgress(db.Model):
             self.completed = True
             self.completed_at = datetime.utcnow()
 
+class UserActivity(db.Model):
+    """Days a user was active, as a bitmap: bit i of ``days`` is ``first_day + i``"""
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    first_day = db.Column(db.Date, nullable=False)
+    days = db.Column(db.LargeBinary, nullable=False, default=b'')
+    
+    def __repr__(self):
+        return f'<UserActivity User:{self.user_id} since {self.first_day}>'
+    
+    def is_active_on(self, day):
+        offset = (day - self.first_day).days
+        if offset < 0 or offset >= len(self.days) * 8:
+            return False
+        return bool(self.days[offset // 8] & (1 << (offset % 8)))
+    
+    def mark_active(self, day):
+        """Set the bit for ``day``, growing the bitmap as needed"""
+        if self.first_day is None or day < self.first_day:
+            # Re-base the bitmap so that ``day`` becomes bit 0
+            earlier = list(self.iter_active_days()) if self.first_day else []
+            self.first_day = day
+            self.days = b''
+            for active_day in earlier:
+                self.mark_active(active_day)
+        offset = (day - self.first_day).days
+        bits = bytearray(self.days or b'')
+        if offset // 8 >= len(bits):
+            bits.extend(b'\x00' * (offset // 8 + 1 - len(bits)))
+        bits[offset // 8] |= 1 << (offset % 8)
+        self.days = bytes(bits)
+    
+    def iter_active_days(self):
+        for index, byte in enumerate(self.days or b''):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield self.first_day + timedelta(days=index * 8 + bit)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
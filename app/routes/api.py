@@ -1,9 +1,18 @@
-from flask import Blueprint, request, jsonify
+from urllib.parse import quote_plus
+
+from flask import Blueprint, request, jsonify, url_for
 from flask_login import login_required, current_user
 from app import db
-from app.models.course import Quiz, Question, Answer, QuizAttempt
+from app.models.course import Quiz, QuizAttempt
 from app.models.user import UserProgress
-from app.models.gamification import Achievement, UserAchievement
+from app.services.achievements import award_achievements
+from app.services.enrollments import is_enrolled
+from app.services.heartbeats import lesson_course_id, record_heartbeat
+from app.services.points import has_award
+from app.services.progress import (get_progress_for_courses, mark_lesson_completed, record_course_completion,
+                                   record_lesson_completion)
+from app.services.quizzes import grade_quiz
+from app.services.streaks import record_activity
 from config import Config
 
 bp = Blueprint('api', __name__)
@@ -26,25 +35,19 @@ def submit_quiz(quiz_id):
         return jsonify({'success': False, 'message': 'Quiz already completed'})
     
     # Calculate score
-    questions = quiz.questions.all()
-    correct_answers = []
-    score = 0
-    
-    for question in questions:
-        question_id_str = str(question.id)
-        if question_id_str in answers:
-            selected_answer_id = int(answers[question_id_str])
-            correct_answer = question.answers.filter_by(is_correct=True).first()
-            
-            if correct_answer and selected_answer_id == correct_answer.id:
-                score += 1
-                correct_answers.append(correct_answer.id)
-            
-    total_questions = len(questions)
-    percentage = (score / total_questions) * 100 if total_questions > 0 else 0
-    
-    # Calculate points earned
-    points_earned = int((percentage / 100) * Config.POINTS_PER_QUIZ)
+    result = grade_quiz(quiz_id, answers)
+    score = result.score
+    correct_answers = result.correct_answer_ids
+    total_questions = result.total_questions
+    percentage = result.percentage
+    
+    # Only a pass earns points, so a failed attempt leaves the quiz's award open
+    passed = percentage >= Config.QUIZ_PASS_PERCENTAGE
+    first_pass = passed and not has_award(current_user.id, 'quiz', quiz_id)
+    points = int((percentage / 100) * Config.POINTS_PER_QUIZ) if passed else 0
+    old_points, new_points = current_user.add_points(points, 'quiz', quiz_id,
+                                                      course_id=quiz.course_id)
+    points_earned = new_points - old_points
     
     # Save quiz attempt
     attempt = QuizAttempt(
@@ -55,11 +58,12 @@ def submit_quiz(quiz_id):
     )
     db.session.add(attempt)
     
-    # Add points to user
-    current_user.add_points(points_earned)
+    changes = {'points': (old_points, new_points), 'streak_days': record_activity(current_user)}
+    if first_pass:
+        changes['quizzes_passed'] = current_user.record_quiz_passed()
     
     # Check for new achievements
-    new_achievements = check_achievements(current_user)
+    new_achievements = award_achievements(current_user, changes)
     
     db.session.commit()
     
@@ -84,34 +88,45 @@ def submit_quiz(quiz_id):
 @login_required
 def update_lesson_progress(lesson_id):
     """Update lesson progress"""
+    from app.models.course import Lesson
+    lesson = Lesson.query.get_or_404(lesson_id)
     data = request.get_json()
     completed = data.get('completed', True)
     
-    # Get or create progress record
-    progress = UserProgress.query.filter_by(
-        user_id=current_user.id,
-        lesson_id=lesson_id
-    ).first()
-    
-    if not progress:
-        progress = UserProgress(user_id=current_user.id, lesson_id=lesson_id)
-        db.session.add(progress)
+    # Get or create progress record; only the request that completes the lesson counts it
+    newly_completed = False
+    if completed:
+        progress, newly_completed = mark_lesson_completed(current_user.id, lesson_id)
+    else:
+        progress = UserProgress.query.filter_by(
+            user_id=current_user.id,
+            lesson_id=lesson_id
+        ).first()
+        
+        if not progress:
+            progress = UserProgress(user_id=current_user.id, lesson_id=lesson_id)
+            db.session.add(progress)
     
     # Update progress
-    if completed and not progress.completed:
-        progress.mark_completed()
-        current_user.add_points(Config.POINTS_PER_LESSON)
-        points_earned = Config.POINTS_PER_LESSON
+    changes = {}
+    if newly_completed:
+        course_completed = record_lesson_completion(current_user.id, lesson.course_id)
+        changes['points'] = current_user.add_points(Config.POINTS_PER_LESSON, 'lesson', lesson_id,
+                                                    course_id=lesson.course_id)
+        changes['lessons_completed'] = current_user.record_lesson_completed()
+        changes['streak_days'] = record_activity(current_user)
+        if course_completed:
+            record_course_completion(current_user, lesson.course_id, changes)
+        points_earned = changes['points'][1] - changes['points'][0]
     else:
         points_earned = 0
+        course_completed = False
     
     # Get course progress
-    from app.models.course import Lesson
-    lesson = Lesson.query.get(lesson_id)
-    course_progress = current_user.get_course_progress(lesson.course_id) if lesson else 0
+    course_progress = get_progress_for_courses(current_user, [lesson.course_id])[lesson.course_id].percentage
     
     # Check for new achievements
-    new_achievements = check_achievements(current_user)
+    new_achievements = award_achievements(current_user, changes)
     
     db.session.commit()
     
@@ -120,6 +135,7 @@ def update_lesson_progress(lesson_id):
         'completed': progress.completed,
         'points_earned': points_earned,
         'progress_percentage': course_progress,
+        'course_completed': course_completed,
         'new_achievements': [
             {
                 'id': a.id,
@@ -130,6 +146,69 @@ def update_lesson_progress(lesson_id):
         ]
     })
 
+@bp.route('/lesson/<int:lesson_id>/heartbeat', methods=['POST'])
+@login_required
+def lesson_heartbeat(lesson_id):
+    """Record time spent on an open lesson; written to the database in batches"""
+    course_id = lesson_course_id(lesson_id)
+    if course_id is None:
+        return jsonify({'success': False, 'message': 'Lesson not found'}), 404
+    if not is_enrolled(current_user.id, course_id):
+        return jsonify({'success': False, 'message': 'You must be enrolled in this course'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = record_heartbeat(current_user.id, lesson_id, data.get('seconds', 0))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid seconds'}), 400
+    
+    return jsonify({'success': True, 'seconds': seconds})
+
+@bp.route('/admin/users/import', methods=['POST'])
+@login_required
+def import_users():
+    """Bulk-create users and enrollments from an uploaded CSV or NDJSON file"""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    from app.services.provisioning import format_for_filename, parse_import, start_import_job
+    
+    upload = request.files.get('file')
+    if upload:
+        data = upload.read()
+        fmt = request.form.get('format') or format_for_filename(upload.filename)
+    else:
+        data = request.get_data()
+        fmt = request.args.get('format') or ('ndjson' if 'ndjson' in (request.content_type or '') else 'csv')
+    
+    try:
+        rows, errors = parse_import(data, fmt)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    # Hashing a cohort's passwords can outlast the request timeout, so it runs in the background
+    job_id = start_import_job(rows, errors)
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('api.import_status', job_id=job_id)
+    }), 202
+
+@bp.route('/admin/users/import/<job_id>')
+@login_required
+def import_status(job_id):
+    """Progress or result of a bulk user import"""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    from app.services.provisioning import get_import_job
+    
+    job = get_import_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown import job'}), 404
+    return jsonify({'success': True, **job})
+
 @bp.route('/search')
 def search():
     """Search courses and lessons"""
@@ -138,66 +217,51 @@ def search():
     if len(query) < 2:
         return jsonify({'results': []})
     
-    from app.models.course import Course, Lesson
-    
-    # Search courses
-    courses = Course.query.filter(
-        Course.title.contains(query) | Course.description.contains(query)
-    ).limit(5).all()
+    from app.services.search_backends import search as search_index, snippets as search_snippets
     
-    # Search lessons
-    lessons = Lesson.query.filter(
-        Lesson.title.contains(query) | Lesson.content.contains(query)
-    ).limit(5).all()
+    # Ranked matches from the search index, with snippets cut around the matched terms
+    hits = search_index(query, kinds=('course',), limit=5) + search_index(query, kinds=('lesson',), limit=5)
+    snippets = search_snippets(query, hits)
     
     results = []
     
-    for course in courses:
-        results.append({
-            'type': 'course',
-            'title': course.title,
-            'description': course.description[:150] + '...' if len(course.description) > 150 else course.description,
-            'url': f'/courses/{course.id}'
-        })
-    
-    for lesson in lessons:
+    for hit in hits:
+        snippet = snippets.get((hit.kind, hit.id))
+        if snippet is None:
+            continue  # deleted since it was matched
+        if hit.kind == 'course':
+            url = f'/courses/{hit.id}'
+        else:
+            url = f'/courses/{hit.course_id}/lessons/{hit.id}'
         results.append({
-            'type': 'lesson',
-            'title': lesson.title,
-            'description': lesson.content[:150] + '...' if len(lesson.content) > 150 else lesson.content,
-            'url': f'/courses/{lesson.course_id}/lessons/{lesson.id}'
+            'type': hit.kind,
+            'title': hit.title,
+            'description': snippet.text,
+            'highlights': [list(span) for span in snippet.highlights],
+            'url': url
         })
     
     return jsonify({'results': results})
 
-def check_achievements(user):
-    """Check and award new achievements"""
-    new_achievements = []
-    
-    # Get all achievements
-    achievements = Achievement.query.all()
-    earned_achievement_ids = {ua.achievement_id for ua in user.achievements}
-    
-    for achievement in achievements:
-        if achievement.id not in earned_achievement_ids:
-            # Check achievement criteria (simplified logic)
-            should_award = False
-            
-            if 'First Steps' in achievement.name and user.total_points >= 100:
-                should_award = True
-            elif 'Knowledge Seeker' in achievement.name and user.total_points >= 500:
-                should_award = True
-            elif 'Eco Warrior' in achievement.name and user.total_points >= 1000:
-                should_award = True
-            elif 'Environmental Expert' in achievement.name and user.total_points >= 2500:
-                should_award = True
-            
-            if should_award:
-                user_achievement = UserAchievement(
-                    user_id=user.id,
-                    achievement_id=achievement.id
-                )
-                db.session.add(user_achievement)
-                new_achievements.append(achievement)
-    
-    return new_achievements
+@bp.route('/suggest')
+def suggest():
+    """Typeahead suggestions for a search prefix, served from memory"""
+    from app.services.suggest import suggest as suggest_prefix
+    
+    query = request.args.get('q', '')[:100]
+    limit = max(1, min(request.args.get('limit', 8, type=int), Config.SUGGEST_MAX_RESULTS))
+    
+    suggestions = []
+    for suggestion in suggest_prefix(query, limit):
+        if suggestion.kind == 'course':
+            url = f'/courses/{suggestion.id}'
+        elif suggestion.kind == 'lesson':
+            url = f'/courses/{suggestion.course_id}/lessons/{suggestion.id}'
+        else:
+            url = f'/courses/?search={quote_plus(suggestion.text)}'
+        suggestions.append({'text': suggestion.text, 'type': suggestion.kind, 'url': url})
+    
+    # Identical prefixes from debounced clients are answered by the browser or a proxy
+    response = jsonify({'suggestions': suggestions})
+    response.headers['Cache-Control'] = f'public, max-age={Config.SUGGEST_CACHE_SECONDS}'
+    return response
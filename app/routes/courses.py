@@ -1,8 +1,17 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, abort
 from flask_login import login_required, current_user
 from app import db
 from app.models.course import Course, Lesson, Quiz
 from app.models.user import Enrollment, UserProgress
+from app.services.achievements import award_achievements
+from app.services.courses import get_course_outline
+from app.services.enrollments import enrolled_course_ids, enrollment_required, is_enrolled
+from app.services.points import has_award
+from app.services.progress import (get_progress_for_courses, init_enrollment_counters, mark_lesson_completed,
+                                   record_course_completion, record_lesson_completion)
+from app.services.quizzes import get_quiz_bundle, grade_quiz
+from app.services.search_backends import search as search_courses
+from app.services.streaks import record_activity
 
 bp = Blueprint('courses', __name__)
 
@@ -16,20 +25,30 @@ def index():
     query = Course.query
     
     if search:
-        query = query.filter(Course.title.contains(search) | Course.description.contains(search))
+        # Rank by relevance using the search index
+        ranked_ids = [hit.id for hit in search_courses(search, kinds=('course',))]
+        if ranked_ids:
+            query = query.filter(Course.id.in_(ranked_ids)).order_by(
+                db.case({course_id: rank for rank, course_id in enumerate(ranked_ids)}, value=Course.id)
+            )
+        else:
+            query = query.filter(db.false())
+    else:
+        query = query.order_by(Course.created_at.desc())
     
     if difficulty:
         query = query.filter_by(difficulty=difficulty)
     
-    courses = query.order_by(Course.created_at.desc()).paginate(
+    courses = query.paginate(
         page=page, per_page=12, error_out=False
     )
+    Course.attach_counts(courses.items)
     
     # Add enrollment status for each course if user is logged in
     if current_user.is_authenticated:
-        enrolled_course_ids = {e.course_id for e in current_user.enrollments}
+        enrolled_ids = enrolled_course_ids(current_user.id)
         for course in courses.items:
-            course.is_enrolled = course.id in enrolled_course_ids
+            course.is_enrolled = course.id in enrolled_ids
     
     return render_template('courses/index.html', 
                          courses=courses,
@@ -45,6 +64,7 @@ def detail(course_id):
     
     enrollment = None
     progress_data = {}
+    course_progress = None
     
     if current_user.is_authenticated:
         enrollment = Enrollment.query.filter_by(
@@ -66,13 +86,16 @@ def detail(course_id):
                     'completed': lesson.id in user_progress and user_progress[lesson.id].completed,
                     'progress': user_progress.get(lesson.id)
                 }
+            
+            course_progress = get_progress_for_courses(current_user, [course_id])[course_id]
     
     return render_template('courses/detail.html',
                          course=course,
                          lessons=lessons,
                          quizzes=quizzes,
                          enrollment=enrollment,
-                         progress_data=progress_data)
+                         progress_data=progress_data,
+                         course_progress=course_progress)
 
 @bp.route('/<int:course_id>/enroll', methods=['POST'])
 @login_required
@@ -81,17 +104,13 @@ def enroll(course_id):
     course = Course.query.get_or_404(course_id)
     
     # Check if already enrolled
-    existing_enrollment = Enrollment.query.filter_by(
-        user_id=current_user.id,
-        course_id=course_id
-    ).first()
-    
-    if existing_enrollment:
+    if is_enrolled(current_user.id, course_id):
         flash('You are already enrolled in this course!', 'info')
         return redirect(url_for('courses.detail', course_id=course_id))
     
     # Create enrollment
     enrollment = Enrollment(user_id=current_user.id, course_id=course_id)
+    init_enrollment_counters(enrollment)
     db.session.add(enrollment)
     db.session.commit()
     
@@ -100,6 +119,7 @@ def enroll(course_id):
 
 @bp.route('/<int:course_id>/lessons/<int:lesson_id>')
 @login_required
+@enrollment_required('access lessons')
 def lesson(course_id, lesson_id):
     """Individual lesson view"""
     course = Course.query.get_or_404(course_id)
@@ -110,16 +130,6 @@ def lesson(course_id, lesson_id):
         flash('Lesson not found in this course', 'error')
         return redirect(url_for('courses.detail', course_id=course_id))
     
-    # Check enrollment
-    enrollment = Enrollment.query.filter_by(
-        user_id=current_user.id,
-        course_id=course_id
-    ).first()
-    
-    if not enrollment:
-        flash('You must be enrolled in this course to access lessons', 'error')
-        return redirect(url_for('courses.detail', course_id=course_id))
-    
     # Get or create progress record
     progress = UserProgress.query.filter_by(
         user_id=current_user.id,
@@ -131,12 +141,10 @@ def lesson(course_id, lesson_id):
         db.session.add(progress)
         db.session.commit()
     
-    # Get all lessons for navigation
-    all_lessons = course.lessons.order_by(Lesson.order).all()
-    current_lesson_index = next((i for i, l in enumerate(all_lessons) if l.id == lesson_id), 0)
-    
-    prev_lesson = all_lessons[current_lesson_index - 1] if current_lesson_index > 0 else None
-    next_lesson = all_lessons[current_lesson_index + 1] if current_lesson_index < len(all_lessons) - 1 else None
+    # Navigation comes from the cached outline, so only this lesson's body is loaded
+    outline = get_course_outline(course_id)
+    current_lesson_index = outline.position(lesson_id) or 0
+    prev_lesson, next_lesson = outline.neighbours(lesson_id)
     
     return render_template('courses/lesson.html',
                          course=course,
@@ -145,42 +153,31 @@ def lesson(course_id, lesson_id):
                          prev_lesson=prev_lesson,
                          next_lesson=next_lesson,
                          lesson_number=current_lesson_index + 1,
-                         total_lessons=len(all_lessons))
+                         total_lessons=max(len(outline), 1))
 
 @bp.route('/<int:course_id>/quiz/<int:quiz_id>')
 @login_required
+@enrollment_required('take quizzes')
 def quiz(course_id, quiz_id):
     """Quiz view"""
     course = Course.query.get_or_404(course_id)
-    quiz = Quiz.query.get_or_404(quiz_id)
+    quiz = get_quiz_bundle(quiz_id)
+    if quiz is None:
+        abort(404)
     
     # Verify quiz belongs to course
     if quiz.course_id != course_id:
         flash('Quiz not found in this course', 'error')
         return redirect(url_for('courses.detail', course_id=course_id))
     
-    # Check enrollment
-    enrollment = Enrollment.query.filter_by(
-        user_id=current_user.id,
-        course_id=course_id
-    ).first()
-    
-    if not enrollment:
-        flash('You must be enrolled in this course to take quizzes', 'error')
-        return redirect(url_for('courses.detail', course_id=course_id))
-    
-    # Get questions with answers
-    questions = quiz.questions.order_by('order').all()
-    for question in questions:
-        question.answers_list = question.answers.all()
-    
     return render_template('courses/quiz.html',
                          course=course,
                          quiz=quiz,
-                         questions=questions)
+                         questions=quiz.questions)
 
 @bp.route('/<int:course_id>/quiz/<int:quiz_id>/submit', methods=['POST'])
 @login_required
+@enrollment_required('take quizzes')
 def submit_quiz(course_id, quiz_id):
     """Handle quiz submission and scoring"""
     course = Course.query.get_or_404(course_id)
@@ -191,44 +188,40 @@ def submit_quiz(course_id, quiz_id):
         flash('Quiz not found in this course', 'error')
         return redirect(url_for('courses.detail', course_id=course_id))
     
-    # Check enrollment
-    enrollment = Enrollment.query.filter_by(
-        user_id=current_user.id,
-        course_id=course_id
-    ).first()
-    
-    if not enrollment:
-        flash('You must be enrolled in this course to take quizzes', 'error')
-        return redirect(url_for('courses.detail', course_id=course_id))
-    
-    # Get questions and process answers
-    questions = quiz.questions.order_by('order').all()
-    total_questions = len(questions)
-    correct_answers = 0
-    
-    for question in questions:
-        submitted_answer_id = request.form.get(f'q{question.id}')
-        if submitted_answer_id:
-            # Find the correct answer
-            correct_answer = question.answers.filter_by(is_correct=True).first()
-            if correct_answer and str(correct_answer.id) == submitted_answer_id:
-                correct_answers += 1
-    
-    # Calculate score percentage
-    score_percentage = (correct_answers / total_questions * 100) if total_questions > 0 else 0
+    # Grade submitted answers (form fields are named q<question_id>)
+    submitted = {key[1:]: value for key, value in request.form.items() if key.startswith('q')}
+    result = grade_quiz(quiz_id, submitted)
+    total_questions = result.total_questions
+    correct_answers = result.score
+    score_percentage = result.percentage
     
-    # Award points based on performance
+    # Award points based on performance (only the first passing attempt earns points)
     from config import Config
     if score_percentage >= 80:
         points_awarded = Config.POINTS_PER_QUIZ
-        current_user.total_points += points_awarded
-        flash(f'Excellent! You scored {score_percentage:.0f}% and earned {points_awarded} points!', 'success')
     elif score_percentage >= 60:
         points_awarded = Config.POINTS_PER_QUIZ // 2
-        current_user.total_points += points_awarded
-        flash(f'Good job! You scored {score_percentage:.0f}% and earned {points_awarded} points!', 'info')
     else:
         points_awarded = 0
+    
+    changes = {'streak_days': record_activity(current_user)}
+    if score_percentage >= Config.QUIZ_PASS_PERCENTAGE and not has_award(current_user.id, 'quiz', quiz_id):
+        changes['quizzes_passed'] = current_user.record_quiz_passed()
+    if points_awarded > 0:
+        old_points, new_points = current_user.add_points(points_awarded, 'quiz', quiz_id,
+                                                          course_id=course_id)
+        points_awarded = new_points - old_points
+        if points_awarded:
+            changes['points'] = (old_points, new_points)
+    award_achievements(current_user, changes)
+    
+    if points_awarded >= Config.POINTS_PER_QUIZ:
+        flash(f'Excellent! You scored {score_percentage:.0f}% and earned {points_awarded} points!', 'success')
+    elif points_awarded > 0:
+        flash(f'Good job! You scored {score_percentage:.0f}% and earned {points_awarded} points!', 'info')
+    elif score_percentage >= 60:
+        flash(f'You scored {score_percentage:.0f}%. You have already earned points for this quiz.', 'info')
+    else:
         flash(f'You scored {score_percentage:.0f}%. Try reviewing the material and take the quiz again!', 'warning')
     
     db.session.commit()
@@ -243,6 +236,7 @@ def submit_quiz(course_id, quiz_id):
 
 @bp.route('/<int:course_id>/lessons/<int:lesson_id>/complete', methods=['POST'])
 @login_required
+@enrollment_required('complete lessons')
 def complete_lesson(course_id, lesson_id):
     """Mark lesson as completed"""
     course = Course.query.get_or_404(course_id)
@@ -253,41 +247,30 @@ def complete_lesson(course_id, lesson_id):
         flash('Lesson not found in this course', 'error')
         return redirect(url_for('courses.detail', course_id=course_id))
     
-    # Check enrollment
-    enrollment = Enrollment.query.filter_by(
-        user_id=current_user.id,
-        course_id=course_id
-    ).first()
-    
-    if not enrollment:
-        flash('You must be enrolled in this course to complete lessons', 'error')
-        return redirect(url_for('courses.detail', course_id=course_id))
-    
-    # Get or create progress record
-    progress = UserProgress.query.filter_by(
-        user_id=current_user.id,
-        lesson_id=lesson_id
-    ).first()
-    
-    if not progress:
-        progress = UserProgress(user_id=current_user.id, lesson_id=lesson_id)
-        db.session.add(progress)
-    
-    # Mark as completed
-    progress.completed = True
-    progress.completed_at = db.func.current_timestamp()
-    
-    # Award points for completion
-    if not progress.completed:
+    # Award points only if this request is the one that completed the lesson
+    progress, newly_completed = mark_lesson_completed(current_user.id, lesson_id)
+    if newly_completed:
         from config import Config
-        current_user.total_points += Config.POINTS_PER_LESSON
-        points_awarded = Config.POINTS_PER_LESSON
+        course_completed = record_lesson_completion(current_user.id, course_id)
+        changes = {
+            'points': current_user.add_points(Config.POINTS_PER_LESSON, 'lesson', lesson_id,
+                                              course_id=course_id),
+            'lessons_completed': current_user.record_lesson_completed(),
+            'streak_days': record_activity(current_user)
+        }
+        if course_completed:
+            record_course_completion(current_user, course_id, changes)
+        award_achievements(current_user, changes)
+        points_awarded = changes['points'][1] - changes['points'][0]
     else:
         points_awarded = 0
+        course_completed = False
     
     db.session.commit()
     
-    if points_awarded > 0:
+    if course_completed:
+        flash('Course completed! You earned {} points.'.format(points_awarded), 'success')
+    elif points_awarded > 0:
         flash('Lesson completed! You earned {} points.'.format(points_awarded), 'success')
     else:
         flash('Lesson already completed!', 'info')
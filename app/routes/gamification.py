@@ -1,58 +1,58 @@
-from flask import Blueprint, render_template, jsonify
+from flask import Blueprint, render_template, jsonify, request
 from flask_login import login_required, current_user
 from app.models.user import User
-from app.models.gamification import LeaderboardView, Achievement, Badge, UserAchievement
+from app.models.course import Course
+from app.models.gamification import LeaderboardView
+from app.services.catalog import earned_achievement_ids, get_catalog
+from app.services.etag import etag_json
+from app.services.leaderboard import WINDOWS
 
 bp = Blueprint('gamification', __name__)
 
 @bp.route('/leaderboard')
 @login_required
 def leaderboard():
-    """Display leaderboard with top users"""
-    top_users = LeaderboardView.top_users(50)
-    current_user_rank = current_user.get_leaderboard_rank()
+    """Display leaderboard with top users, optionally for a time window or course"""
+    window = request.args.get('window', 'all')
+    if window not in WINDOWS:
+        window = 'all'
+    course_id = request.args.get('course', type=int)
+    course = Course.query.get(course_id) if course_id else None
     
-    # Add rank to each user
-    for i, user in enumerate(top_users):
-        user.rank = i + 1
-        user.is_current_user = (user.id == current_user.id)
+    top_users = LeaderboardView.snapshot(50, window=window, course_id=course_id)
+    current_user_rank = LeaderboardView.user_rank(current_user, window=window, course_id=course_id)
     
     return render_template('gamification/leaderboard.html',
                          top_users=top_users,
-                         current_user_rank=current_user_rank)
+                         current_user_rank=current_user_rank,
+                         window=window,
+                         course=course)
 
 @bp.route('/achievements')
 @login_required
 def achievements():
     """Display user's achievements and available badges"""
-    user_achievements = current_user.get_achievements()
-    all_achievements = Achievement.query.all()
-    all_badges = Badge.query.all()
-    
-    # Mark which achievements/badges user has earned
-    earned_achievement_ids = {a.id for a in user_achievements}
-    
-    for achievement in all_achievements:
-        achievement.earned = achievement.id in earned_achievement_ids
-    
-    # Calculate progress toward badges
-    user_badges = []
-    for badge in all_badges:
-        earned = current_user.total_points >= badge.points_required
-        progress = min((current_user.total_points / badge.points_required) * 100, 100) if badge.points_required > 0 else 100
-        user_badges.append({
-            'badge': badge,
-            'earned': earned,
-            'progress': progress
-        })
+    catalog = get_catalog()
+    earned_ids = earned_achievement_ids(current_user.id)
     
     return render_template('gamification/achievements.html',
-                         achievements=all_achievements,
-                         badges=user_badges,
+                         achievements=catalog.achievements_for(earned_ids),
+                         badges=catalog.badge_progress(current_user.total_points),
                          user_points=current_user.total_points)
 
+def user_stats_version():
+    """Everything the user-stats payload depends on, without touching the database.
+
+    Totals and level are included directly because bulk maintenance jobs
+    rewrite them without bumping ``stats_version``.
+    """
+    return (current_user.id, current_user.stats_version or 0,
+            current_user.total_points or 0, current_user.level,
+            current_user.get_leaderboard_rank(), current_user.current_streak)
+
 @bp.route('/api/user-stats')
 @login_required
+@etag_json(user_stats_version)
 def user_stats():
     """API endpoint for user gamification stats"""
     return jsonify({
@@ -61,5 +61,5 @@ def user_stats():
         'level_progress': current_user.get_level_progress(),
         'rank': current_user.get_leaderboard_rank(),
         'achievements_count': current_user.achievements.count(),
-        'streak_days': current_user.streak_days
+        'streak_days': current_user.current_streak
     })
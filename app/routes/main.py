@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
 from app import db
 from app.models.user import User, Enrollment
 from app.models.course import Course
@@ -10,8 +11,8 @@ bp = Blueprint('main', __name__)
 @bp.route('/')
 def index():
     """Home page showing featured courses and platform overview"""
-    featured_courses = Course.query.limit(6).all()
-    top_learners = LeaderboardView.top_users(5)
+    featured_courses = Course.attach_counts(Course.query.limit(6).all())
+    top_learners = LeaderboardView.snapshot(5)
     
     stats = {
         'total_users': User.query.count(),
@@ -28,7 +29,7 @@ def index():
 @login_required
 def dashboard():
     """User dashboard showing progress and recommendations"""
-    user_enrollments = current_user.enrollments.all()
+    user_enrollments = current_user.enrollments.options(joinedload(Enrollment.course)).all()
     recent_courses = Course.query.order_by(Course.created_at.desc()).limit(4).all()
     
     # Calculate overall progress
@@ -55,7 +56,7 @@ def dashboard():
 def profile():
     """User profile page"""
     user_stats = {
-        'courses_completed': current_user.enrollments.filter_by(is_completed=True).count(),
+        'courses_completed': current_user.courses_completed or 0,
         'total_enrollments': current_user.enrollments.count(),
         'achievements_earned': current_user.achievements.count(),
         'current_level': current_user.get_level(),
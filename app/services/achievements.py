@@ -0,0 +1,124 @@
+"""Compiled achievement rules.
+
+Achievement criteria are stored on each ``Achievement`` as a metric name and
+a threshold. They are compiled from the catalog snapshot into a sorted
+threshold list per metric, and recompiled only when the catalog version
+changes. Evaluating an event is a bisect over the range of thresholds the
+user's metric just crossed; when nothing is crossed no query is issued.
+"""
+
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+
+from app import db
+from app.models.gamification import UserAchievement
+from app.services.catalog import get_catalog
+
+METRICS = ('points', 'lessons_completed', 'quizzes_passed', 'streak_days', 'courses_completed')
+
+# Criteria for achievements created before criteria columns existed
+LEGACY_CRITERIA = {
+    'First Steps': ('lessons_completed', 1),
+    'Knowledge Seeker': ('points', 500),
+    'Eco Warrior': ('points', 1000),
+    'Environmental Expert': ('points', 2500),
+    'Green Champion': ('courses_completed', 5),
+}
+
+AchievementRule = namedtuple('AchievementRule', 'id name description icon metric threshold')
+
+
+class AchievementRules:
+    """Per-metric threshold table compiled from the achievement catalog"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table = None
+        self._version = None
+
+    def compile(self, catalog):
+        by_metric = {metric: [] for metric in METRICS}
+        for achievement in catalog.achievements:
+            metric, threshold = achievement.criteria_metric, achievement.criteria_threshold
+            if metric is None and achievement.name in LEGACY_CRITERIA:
+                metric, threshold = LEGACY_CRITERIA[achievement.name]
+            if metric not in by_metric or threshold is None:
+                continue
+            by_metric[metric].append(AchievementRule(
+                achievement.id, achievement.name, achievement.description,
+                achievement.icon, metric, threshold
+            ))
+
+        table = {}
+        for metric, rules in by_metric.items():
+            rules.sort(key=lambda rule: (rule.threshold, rule.id))
+            table[metric] = ([rule.threshold for rule in rules], rules)
+        with self._lock:
+            self._table = table
+            self._version = catalog.version
+        return table
+
+    def _get_table(self):
+        catalog = get_catalog()
+        table = self._table
+        if table is None or self._version != catalog.version:
+            table = self.compile(catalog)
+        return table
+
+    def crossed(self, metric, old_value, new_value):
+        """Rules whose threshold lies in (old_value, new_value]"""
+        thresholds, rules = self._get_table().get(metric, ((), ()))
+        if not thresholds or new_value is None:
+            return []
+        lo = bisect_right(thresholds, old_value if old_value is not None else float('-inf'))
+        hi = bisect_right(thresholds, new_value)
+        return list(rules[lo:hi])
+
+
+achievement_rules = AchievementRules()
+
+
+def award_achievements(user, changes):
+    """Award achievements for metric changes.
+
+    ``changes`` maps a metric name to an ``(old_value, new_value)`` pair.
+    Returns the newly awarded rules, which expose the same ``id``, ``name``,
+    ``description`` and ``icon`` attributes as ``Achievement``.
+    """
+    candidates = {}
+    for metric, (old_value, new_value) in changes.items():
+        for rule in achievement_rules.crossed(metric, old_value, new_value):
+            candidates[rule.id] = rule
+    if not candidates:
+        return []
+
+    already_earned = {
+        achievement_id for (achievement_id,) in db.session.query(UserAchievement.achievement_id).filter(
+            UserAchievement.user_id == user.id,
+            UserAchievement.achievement_id.in_(list(candidates))
+        )
+    }
+
+    new_achievements = []
+    for achievement_id, rule in sorted(candidates.items(), key=lambda item: item[1].threshold):
+        if achievement_id in already_earned:
+            continue
+        db.session.add(UserAchievement(user_id=user.id, achievement_id=achievement_id))
+        new_achievements.append(rule)
+    if new_achievements:
+        user.bump_stats_version()
+    return new_achievements
+
+
+def sync_achievements(user):
+    """Award anything the user qualifies for but has not been given yet"""
+    return award_achievements(user, {
+        'points': (None, user.total_points or 0),
+        'lessons_completed': (None, user.lessons_completed or 0),
+        'quizzes_passed': (None, user.quizzes_passed or 0),
+        'streak_days': (None, user.streak_days or 0),
+        'courses_completed': (None, user.courses_completed or 0),
+    })
+
+
@@ -0,0 +1,203 @@
+"""Cache shared by every worker on a host.
+
+Values are JSON documents stored in a local SQLite file, so all gunicorn
+workers see the same entries and the same invalidations. Each entry may carry
+a ``floor`` and ``scope`` so writers can drop every entry a change could
+affect with one statement (see ``invalidate_floor``). Named version counters
+let workers notice that data they hold in memory has changed elsewhere.
+
+Hit and miss counts are kept in process memory and added to the shared
+counters at most every ``COUNTER_FLUSH_SECONDS``, so reads never take the
+file's write lock.
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+from app.services.commit_hooks import on_commit, queue_after_commit
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entry (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    floor INTEGER,
+    scope INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_cache_entry_floor ON cache_entry (floor);
+CREATE TABLE IF NOT EXISTS cache_counter (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS cache_version (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+COUNTER_FLUSH_SECONDS = 10
+
+
+class SharedCache:
+    """TTL cache backed by a SQLite file, with shared hit/miss counters"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._local = threading.local()
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._counts_pid = os.getpid()
+        self._flushed_at = time.monotonic()
+        atexit.register(self.flush_counters)
+
+    def init_app(self, app):
+        self.path = app.config.get('SHARED_CACHE_PATH') or self.path
+        self._local = threading.local()
+
+    def _connect(self):
+        # Connections are per thread and per process: gunicorn forks workers
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _namespace(key):
+        return key.split(':', 1)[0]
+
+    def _execute(self, sql, params=()):
+        """Run a statement, treating an unavailable cache file as a miss"""
+        try:
+            return self._connect().execute(sql, params)
+        except (sqlite3.Error, OSError):
+            return None
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        cursor = self._execute(
+            'SELECT value FROM cache_entry WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        )
+        row = cursor.fetchone() if cursor else None
+        self._count(f"{self._namespace(key)}.{'hits' if row else 'misses'}")
+        return json.loads(row[0]) if row else None
+
+    def _count(self, name):
+        with self._counts_lock:
+            if self._counts_pid != os.getpid():
+                # Counts copied from the parent by fork belong to the parent
+                self._counts.clear()
+                self._counts_pid = os.getpid()
+            self._counts[name] += 1
+            due = time.monotonic() - self._flushed_at >= COUNTER_FLUSH_SECONDS
+        if due:
+            self.flush_counters()
+
+    def flush_counters(self):
+        """Add this process's pending hit/miss counts to the shared counters"""
+        with self._counts_lock:
+            if self._counts_pid != os.getpid():
+                return
+            counts, self._counts = self._counts, Counter()
+            self._flushed_at = time.monotonic()
+        if not counts:
+            return
+        try:
+            self._connect().executemany(
+                'INSERT INTO cache_counter (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                list(counts.items())
+            )
+        except (sqlite3.Error, OSError):
+            # Keep the counts for the next flush
+            with self._counts_lock:
+                self._counts.update(counts)
+
+    def set(self, key, value, ttl, floor=None, scope=None):
+        self._execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, expires_at, floor, scope) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, json.dumps(value), time.time() + ttl, floor, scope)
+        )
+
+    def delete(self, key):
+        self._execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+    def invalidate_floor(self, value, scope=None):
+        """Drop entries whose floor is at or below ``value``.
+
+        Entries stored with a scope are only dropped when ``scope`` matches;
+        entries without a scope always qualify.
+        """
+        self._execute(
+            'DELETE FROM cache_entry WHERE floor <= ? AND (scope IS NULL OR scope = ?)',
+            (value, scope)
+        )
+
+    def get_version(self, name):
+        """Current value of a shared version counter (0 if never bumped)"""
+        cursor = self._execute('SELECT value FROM cache_version WHERE name = ?', (name,))
+        row = cursor.fetchone() if cursor else None
+        return row[0] if row else 0
+
+    def bump_version(self, name):
+        """Increment a shared version counter so every worker sees a change.
+
+        Returns the new value, or None if the cache is unavailable.
+        """
+        cursor = self._execute(
+            'INSERT INTO cache_version (name, value) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1 RETURNING value',
+            (name,)
+        )
+        rows = cursor.fetchall() if cursor else None
+        return rows[0][0] if rows else None
+
+    def clear(self):
+        self._execute('DELETE FROM cache_entry')
+
+    def stats(self):
+        """Hit/miss counts per key namespace, summed across workers.
+
+        Other workers' counts can lag by up to ``COUNTER_FLUSH_SECONDS``.
+        """
+        self.flush_counters()
+        stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        for name, value in self._execute('SELECT name, value FROM cache_counter') or ():
+            namespace, kind = name.rsplit('.', 1)
+            stats[namespace][kind] = value
+        for counts in stats.values():
+            total = counts['hits'] + counts['misses']
+            counts['hit_rate'] = counts['hits'] / total if total else 0.0
+        return dict(stats)
+
+
+shared_cache = SharedCache()
+
+
+def delete_after_commit(session, *keys):
+    """Delete shared cache keys once the session's transaction commits.
+
+    Deleting earlier would let another worker re-cache the old rows before
+    the new ones are visible.
+    """
+    queue_after_commit(session, 'shared_cache_deletes', *keys)
+
+
+@on_commit('shared_cache_deletes')
+def _delete_pending_keys(keys):
+    for key in set(keys):
+        shared_cache.delete(key)
@@ -0,0 +1,108 @@
+"""Process-wide snapshot of the badge and achievement catalog.
+
+The catalog rarely changes, so each worker keeps an immutable copy with badges
+sorted by ``points_required``. Writes to ``Badge`` or ``Achievement`` bump a
+shared version counter after commit; a worker reloads its copy only when that
+version moves.
+"""
+
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.gamification import Achievement, Badge, UserAchievement
+from app.services.cache import shared_cache
+from app.services.commit_hooks import on_commit, queue_after_commit
+
+VERSION_KEY = 'catalog'
+
+BadgeInfo = namedtuple('BadgeInfo', 'id name description icon points_required')
+AchievementInfo = namedtuple('AchievementInfo', 'id name description icon criteria_metric criteria_threshold')
+EarnedAchievement = namedtuple('EarnedAchievement', 'id name description icon earned')
+
+
+class Catalog:
+    """Immutable badge and achievement lists for one catalog version"""
+
+    def __init__(self, version, badges, achievements):
+        self.version = version
+        self.badges = tuple(sorted(badges, key=lambda badge: (badge.points_required or 0, badge.id)))
+        self.badge_thresholds = tuple(badge.points_required or 0 for badge in self.badges)
+        self.achievements = tuple(achievements)
+
+    def badges_earned(self, points):
+        """Number of badges unlocked at a points total"""
+        return bisect_right(self.badge_thresholds, points or 0)
+
+    def badge_progress(self, points):
+        """[{'badge', 'earned', 'progress'}] for every badge at a points total.
+
+        A badge that needs no points counts as 100% done.
+        """
+        points = points or 0
+        earned_count = self.badges_earned(points)
+        return [
+            {
+                'badge': badge,
+                'earned': i < earned_count,
+                'progress': min(points / badge.points_required * 100, 100)
+                if i >= earned_count and (badge.points_required or 0) > 0 else 100
+            }
+            for i, badge in enumerate(self.badges)
+        ]
+
+    def achievements_for(self, earned_ids):
+        return [EarnedAchievement(a.id, a.name, a.description, a.icon, a.id in earned_ids)
+                for a in self.achievements]
+
+
+_lock = threading.Lock()
+_catalog = None
+
+
+def load_catalog(version):
+    badges = [BadgeInfo(b.id, b.name, b.description, b.icon, b.points_required)
+              for b in Badge.query.all()]
+    achievements = [AchievementInfo(a.id, a.name, a.description, a.icon, a.criteria_metric, a.criteria_threshold)
+                    for a in Achievement.query.order_by(Achievement.id).all()]
+    return Catalog(version, badges, achievements)
+
+
+def get_catalog():
+    """Return the current catalog, reloading it if another worker changed it"""
+    global _catalog
+    version = shared_cache.get_version(VERSION_KEY)
+    catalog = _catalog
+    if catalog is None or catalog.version != version:
+        with _lock:
+            if _catalog is None or _catalog.version != version:
+                _catalog = load_catalog(version)
+            catalog = _catalog
+    return catalog
+
+
+def earned_achievement_ids(user_id):
+    return frozenset(
+        achievement_id for (achievement_id,) in
+        db.session.query(UserAchievement.achievement_id).filter(UserAchievement.user_id == user_id)
+    )
+
+
+def _mark_catalog_changed(mapper, connection, target):
+    queue_after_commit(Session.object_session(target), 'catalog_changed', True)
+
+
+for _model in (Badge, Achievement):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _mark_catalog_changed)
+
+
+@on_commit('catalog_changed')
+def _publish_catalog_change(changes):
+    global _catalog
+    _catalog = None
+    shared_cache.bump_version(VERSION_KEY)
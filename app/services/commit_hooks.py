@@ -0,0 +1,47 @@
+"""Work deferred until a session's outermost transaction commits.
+
+Services queue items on the session while a transaction is open (cache keys
+to delete, versions to bump, documents to reindex) and register one handler
+per queue. The handler runs with the queued items once the whole transaction
+has committed; a rollback discards them.
+
+``after_commit`` and ``after_rollback`` also fire when a ``begin_nested()``
+savepoint is released or rolled back, so both are ignored while the
+outermost transaction is still open.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_handlers = {}
+
+
+def on_commit(name):
+    """Register ``handler(items)`` to run for the ``name`` queue after commit"""
+    def register(handler):
+        _handlers[name] = handler
+        return handler
+    return register
+
+
+def queue_after_commit(session, name, *items):
+    """Add items to a queue that is handled once the outermost transaction commits"""
+    session.info.setdefault(name, []).extend(items)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_handlers(session):
+    if session.in_nested_transaction():
+        return
+    for name, handler in _handlers.items():
+        items = session.info.pop(name, None)
+        if items:
+            handler(items)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_queues(session):
+    if session.in_nested_transaction():
+        return
+    for name in _handlers:
+        session.info.pop(name, None)
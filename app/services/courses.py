@@ -0,0 +1,70 @@
+"""Cached course structure.
+
+Lesson navigation only needs each lesson's id, title and order, so a course's
+outline is loaded with the lesson bodies deferred and kept in the shared
+cache until a lesson in that course changes.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy.orm.attributes import get_history
+
+from app.models.course import Lesson
+from app.services.cache import delete_after_commit, shared_cache
+from config import Config
+
+OutlineEntry = namedtuple('OutlineEntry', 'id title order')
+
+
+class CourseOutline:
+    """Ordered (id, title, order) entries for the lessons of one course"""
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self._positions = {entry.id: i for i, entry in enumerate(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def position(self, lesson_id):
+        """0-based index of a lesson, or None if it is not in the course"""
+        return self._positions.get(lesson_id)
+
+    def neighbours(self, lesson_id):
+        """(previous, next) entries around a lesson; either may be None"""
+        i = self.position(lesson_id)
+        if i is None:
+            return None, None
+        previous = self.entries[i - 1] if i > 0 else None
+        following = self.entries[i + 1] if i + 1 < len(self.entries) else None
+        return previous, following
+
+
+def outline_key(course_id):
+    return f'outline:{course_id}'
+
+
+def get_course_outline(course_id):
+    cached = shared_cache.get(outline_key(course_id))
+    if cached is not None:
+        return CourseOutline(OutlineEntry(*entry) for entry in cached)
+
+    lessons = Lesson.query.options(load_only(Lesson.id, Lesson.title, Lesson.order)).filter_by(
+        course_id=course_id
+    ).order_by(Lesson.order, Lesson.id).all()
+    entries = [OutlineEntry(lesson.id, lesson.title, lesson.order) for lesson in lessons]
+    shared_cache.set(outline_key(course_id), [list(entry) for entry in entries], Config.OUTLINE_CACHE_TTL)
+    return CourseOutline(entries)
+
+
+def _lesson_changed(mapper, connection, lesson):
+    course_ids = {lesson.course_id}
+    course_ids.update(get_history(lesson, 'course_id').deleted or ())
+    delete_after_commit(Session.object_session(lesson),
+                        *(outline_key(course_id) for course_id in course_ids if course_id))
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Lesson, _event, _lesson_changed)
@@ -0,0 +1,67 @@
+"""Cached enrollment membership.
+
+Course routes only need to know whether the current user is enrolled, so the
+set of enrolled course ids is loaded once per request, kept in the shared
+cache for a short while and dropped whenever an enrollment is added or
+removed.
+"""
+
+from functools import wraps
+
+from flask import flash, g, has_request_context, redirect, url_for
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.user import Enrollment
+from app.services.cache import delete_after_commit, shared_cache
+from config import Config
+
+
+def enrollments_key(user_id):
+    return f'enrollments:{user_id}'
+
+
+def enrolled_course_ids(user_id):
+    """Frozen set of course ids the user is enrolled in"""
+    memo = g.setdefault('enrolled_course_ids', {}) if has_request_context() else {}
+    if user_id in memo:
+        return memo[user_id]
+
+    cached = shared_cache.get(enrollments_key(user_id))
+    if cached is None:
+        cached = [course_id for (course_id,) in
+                  db.session.query(Enrollment.course_id).filter_by(user_id=user_id)]
+        shared_cache.set(enrollments_key(user_id), cached, Config.ENROLLMENT_CACHE_TTL)
+
+    memo[user_id] = frozenset(cached)
+    return memo[user_id]
+
+
+def is_enrolled(user_id, course_id):
+    return course_id in enrolled_course_ids(user_id)
+
+
+def enrollment_required(action):
+    """Redirect to the course page unless the current user is enrolled in ``course_id``"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            course_id = kwargs['course_id']
+            if not is_enrolled(current_user.id, course_id):
+                flash(f'You must be enrolled in this course to {action}', 'error')
+                return redirect(url_for('courses.detail', course_id=course_id))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _enrollment_changed(mapper, connection, enrollment):
+    if has_request_context():
+        g.get('enrolled_course_ids', {}).pop(enrollment.user_id, None)
+    delete_after_commit(Session.object_session(enrollment), enrollments_key(enrollment.user_id))
+
+
+for _event in ('after_insert', 'after_delete'):
+    event.listen(Enrollment, _event, _enrollment_changed)
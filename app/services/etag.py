@@ -0,0 +1,39 @@
+"""Conditional GET support for JSON endpoints.
+
+``etag_json`` wraps a view with a cheap version function. When the client's
+``If-None-Match`` already matches the version, the view is never called and
+a 304 is returned; otherwise the response is tagged with the version.
+"""
+
+import hashlib
+from functools import wraps
+
+from flask import make_response, request
+
+
+def make_etag(version):
+    """Turn a version value (or tuple of values) into an opaque ETag"""
+    if isinstance(version, (tuple, list)):
+        version = '-'.join(str(part) for part in version)
+    return hashlib.sha1(str(version).encode('utf-8')).hexdigest()[:20]
+
+
+def etag_json(get_version):
+    """Decorate a view with ETag/If-None-Match handling.
+
+    ``get_version`` receives the view's arguments and must return a value
+    that changes whenever the response body would.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            etag = make_etag(get_version(*args, **kwargs))
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,189 @@
+"""Buffered lesson time tracking.
+
+Open lesson pages post a heartbeat every few seconds. Writing each one would
+turn every open tab into a stream of write transactions, so heartbeats are
+summed per (user, lesson) in process memory and written to
+``UserProgress.time_spent`` as one executemany UPDATE when the buffer reaches
+``HEARTBEAT_FLUSH_SIZE`` keys or ``HEARTBEAT_FLUSH_SECONDS`` have passed.
+
+A background thread flushes on the interval even when no heartbeats arrive,
+and the buffer is flushed on interpreter exit, so a worker that is killed
+outright loses at most one interval of time.
+
+A beat is credited no more time than has passed on the wall clock since the
+previous beat for the same lesson (up to ``HEARTBEAT_MAX_SECONDS`` banked),
+so sending beats faster does not add time. The clock is kept per worker.
+"""
+
+import atexit
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+from app import db
+from app.models.course import Lesson
+from app.models.user import UserProgress
+from config import Config
+
+
+class HeartbeatBuffer:
+    """Per-worker accumulator of seconds spent, keyed by (user_id, lesson_id)"""
+
+    def __init__(self, flush_size=None, flush_seconds=None):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.app = None
+        self._pending = {}
+        self._credited_until = {}  # (user_id, lesson_id) -> monotonic time credited up to
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._pid = None
+        self._stop = threading.Event()
+        self.flushes = 0
+        self.rows_written = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_size = app.config.get('HEARTBEAT_FLUSH_SIZE', self.flush_size)
+        self.flush_seconds = app.config.get('HEARTBEAT_FLUSH_SECONDS', self.flush_seconds)
+
+    def _flush_size(self):
+        return self.flush_size or Config.HEARTBEAT_FLUSH_SIZE
+
+    def _flush_seconds(self):
+        return self.flush_seconds or Config.HEARTBEAT_FLUSH_SECONDS
+
+    def _ensure_flusher(self):
+        # Started lazily so each forked worker gets its own thread
+        if self._pid == os.getpid() or self.app is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending = {}
+            self._credited_until = {}
+        threading.Thread(target=self._run, name='heartbeat-flusher', daemon=True).start()
+        atexit.register(self._flush_in_app)
+
+    def _run(self):
+        while not self._stop.wait(self._flush_seconds()):
+            try:
+                self._flush_in_app()
+            except Exception:
+                # The batch is back in the buffer; keep the thread alive to retry it
+                self.app.logger.exception('Heartbeat flush failed')
+
+    def _flush_in_app(self):
+        with self.app.app_context():
+            self.flush()
+
+    def add(self, user_id, lesson_id, seconds):
+        """Record time spent on a lesson; returns the number of rows flushed, if any.
+
+        A failed flush is logged rather than raised: the beat is already
+        buffered and the next flush retries it.
+        """
+        self._ensure_flusher()
+        key = (user_id, lesson_id)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + seconds
+            due = (len(self._pending) >= self._flush_size()
+                   or time.monotonic() - self._last_flush >= self._flush_seconds())
+        if not due:
+            return 0
+        try:
+            return self.flush()
+        except Exception:
+            current_app.logger.exception('Heartbeat flush failed')
+            return 0
+
+    def credit(self, user_id, lesson_id, seconds, max_seconds):
+        """Seconds of a beat to record, limited by wall-clock time since earlier beats"""
+        self._ensure_flusher()
+        now = time.monotonic()
+        key = (user_id, lesson_id)
+        with self._lock:
+            since = max(self._credited_until.get(key, 0), now - max_seconds)
+            credited = max(0, min(seconds, int(now - since)))
+            self._credited_until[key] = since + credited
+        return credited
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write buffered time in one executemany UPDATE on its own transaction"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+                # Entries older than a full beat allow as much as a missing one
+                horizon = self._last_flush - Config.HEARTBEAT_MAX_SECONDS
+                self._credited_until = {key: until for key, until in self._credited_until.items()
+                                        if until > horizon}
+            if not batch:
+                return 0
+
+            progress = UserProgress.__table__
+            statement = progress.update().where(
+                progress.c.user_id == bindparam('b_user_id'),
+                progress.c.lesson_id == bindparam('b_lesson_id')
+            ).values(time_spent=db.func.coalesce(progress.c.time_spent, 0) + bindparam('b_seconds'))
+            params = [{'b_user_id': user_id, 'b_lesson_id': lesson_id, 'b_seconds': seconds}
+                      for (user_id, lesson_id), seconds in sorted(batch.items())]
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(statement, params)
+            except Exception:
+                # Put the time back so the next flush retries it
+                with self._lock:
+                    for key, seconds in batch.items():
+                        self._pending[key] = self._pending.get(key, 0) + seconds
+                raise
+
+            self.flushes += 1
+            self.rows_written += len(params)
+            return len(params)
+
+    def stop(self):
+        self._stop.set()
+
+
+heartbeat_buffer = HeartbeatBuffer()
+
+
+_lesson_courses = {}
+
+
+def lesson_course_id(lesson_id):
+    """Course of a lesson, or None if there is no such lesson; remembered per worker"""
+    if lesson_id not in _lesson_courses:
+        course_id = db.session.query(Lesson.course_id).filter(Lesson.id == lesson_id).scalar()
+        if course_id is None:
+            return None
+        _lesson_courses[lesson_id] = course_id
+    return _lesson_courses[lesson_id]
+
+
+def record_heartbeat(user_id, lesson_id, seconds):
+    """Buffer one heartbeat, returning the seconds credited.
+
+    A beat is clamped to the most a single beat can account for and to the
+    time that has actually passed since the user's previous beats. Raises
+    TypeError or ValueError if ``seconds`` is not a finite number.
+    """
+    try:
+        seconds = int(seconds)
+    except OverflowError:
+        raise ValueError('seconds must be finite') from None
+    seconds = max(0, min(seconds, Config.HEARTBEAT_MAX_SECONDS))
+    seconds = heartbeat_buffer.credit(user_id, lesson_id, seconds, Config.HEARTBEAT_MAX_SECONDS)
+    if seconds:
+        heartbeat_buffer.add(user_id, lesson_id, seconds)
+    return seconds
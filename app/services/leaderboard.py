@@ -0,0 +1,253 @@
+"""Leaderboard data.
+
+Lifetime rankings come from an in-memory rank index: every user's score is
+kept in a sorted list so rank and top-N lookups are bisect operations and
+slices instead of COUNT/ORDER BY scans. Each gunicorn worker holds its own
+copy; ``reconcile`` re-syncs it against the database.
+
+Time-windowed and per-course rankings come from ``ScoreBucket`` rows, one per
+user, day and course, which are incremented as points are awarded and summed
+over the window on read.
+
+Rendered boards are cached as snapshots in the shared cache, each tagged with
+the lowest score it shows, so an award only invalidates the snapshots the
+awarded user could now appear in.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import date, datetime, timedelta
+
+from app import db
+from app.models.gamification import ScoreBucket
+from app.services.cache import shared_cache
+from app.services.commit_hooks import on_commit, queue_after_commit
+from app.services.sql import upsert
+from config import Config
+
+# Window name -> number of days, including today
+WINDOWS = {'week': 7, 'month': 30}
+
+# Shared version bumped after every committed award, so workers notice others' scores
+RANK_VERSION_KEY = 'rank'
+
+
+class RankIndex:
+    """Sorted score index keyed by user id"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Entries are (-points, user_id) so ascending order is leaderboard order
+        self._entries = []
+        self._scores = {}
+        self._fingerprint = None
+        self._synced_at = None
+        self._version = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def is_built(self):
+        return self._synced_at is not None
+
+    def rebuild(self):
+        """Load every user's score from the database"""
+        from app.models.user import User
+
+        version = shared_cache.get_version(RANK_VERSION_KEY)
+        rows = db.session.query(User.id, User.total_points).all()
+        entries = sorted((-(points or 0), user_id) for user_id, points in rows)
+        with self._lock:
+            self._entries = entries
+            self._scores = {user_id: -neg for neg, user_id in entries}
+            self._fingerprint = self._db_fingerprint()
+            self._synced_at = time.monotonic()
+            self._version = version
+
+    def reconcile(self, max_age=None):
+        """Rebuild if the index is stale and the database has changed.
+
+        Awards committed by other workers bump a shared version, which forces
+        a reload. Changes made outside awards (bulk maintenance jobs) are
+        caught once ``max_age`` seconds have passed by comparing a cheap
+        aggregate fingerprint, reloading the full score list only when it
+        differs.
+        """
+        if max_age is None:
+            max_age = Config.RANK_INDEX_RECONCILE_SECONDS
+        if not self.is_built or shared_cache.get_version(RANK_VERSION_KEY) != self._version:
+            self.rebuild()
+            return True
+        if time.monotonic() - self._synced_at < max_age:
+            return False
+        if self._db_fingerprint() == self._fingerprint:
+            self._synced_at = time.monotonic()
+            return False
+        self.rebuild()
+        return True
+
+    def applied(self, version):
+        """Record that this worker's own award produced the shared ``version``"""
+        with self._lock:
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def update(self, user_id, points):
+        """Set a user's score, moving their entry to its new position"""
+        points = points or 0
+        with self._lock:
+            old = self._scores.get(user_id)
+            if old == points:
+                return
+            if old is not None:
+                i = bisect_left(self._entries, (-old, user_id))
+                if i < len(self._entries) and self._entries[i] == (-old, user_id):
+                    del self._entries[i]
+            insort(self._entries, (-points, user_id))
+            self._scores[user_id] = points
+
+    def rank_for_points(self, points):
+        """1-based rank: one more than the number of strictly higher scores"""
+        with self._lock:
+            return bisect_left(self._entries, (-(points or 0),)) + 1
+
+    def rank(self, user_id, points=None):
+        with self._lock:
+            if points is None:
+                points = self._scores.get(user_id, 0)
+            return self.rank_for_points(points)
+
+    def top(self, limit=10):
+        """Return [(user_id, points)] for the first ``limit`` positions"""
+        with self._lock:
+            return [(user_id, -neg) for neg, user_id in self._entries[:limit]]
+
+    @staticmethod
+    def _db_fingerprint():
+        from app.models.user import User
+
+        count, total, max_id = db.session.query(
+            db.func.count(User.id),
+            db.func.coalesce(db.func.sum(User.total_points), 0),
+            db.func.coalesce(db.func.max(User.id), 0)
+        ).one()
+        return (count, int(total), max_id)
+
+
+rank_index = RankIndex()
+
+
+def get_rank_index():
+    """Return the process-wide index, building or re-syncing it as needed"""
+    rank_index.reconcile()
+    return rank_index
+
+
+def update_rank_after_commit(session, user_id, points):
+    """Move a user in the rank index once their new total is committed"""
+    queue_after_commit(session, 'rank_updates', (user_id, points))
+
+
+@on_commit('rank_updates')
+def _apply_rank_updates(updates):
+    # Later awards in the same transaction carry the newer total
+    for user_id, points in dict(updates).items():
+        rank_index.update(user_id, points)
+    # Other workers reload; this one is already up to date unless it missed another bump
+    version = shared_cache.bump_version(RANK_VERSION_KEY)
+    if version is not None:
+        rank_index.applied(version)
+
+
+def add_to_score_bucket(user_id, points, course_id=None, day=None):
+    """Add points to the user's bucket for a day and course"""
+    if day is None:
+        day = datetime.utcnow().date()
+    course_id = course_id or 0
+
+    # One statement, so concurrent awards neither race nor need a savepoint
+    insert = upsert(ScoreBucket).values(user_id=user_id, day=day, course_id=course_id, points=points)
+    db.session.execute(insert.on_conflict_do_update(
+        index_elements=['user_id', 'day', 'course_id'],
+        set_={'points': ScoreBucket.points + insert.excluded.points}
+    ))
+
+
+def _bucket_totals(window=None, course_id=None):
+    """Query of (user_id, points) summed over the buckets in a window"""
+    total = db.func.sum(ScoreBucket.points).label('points')
+    query = db.session.query(ScoreBucket.user_id, total)
+    if window in WINDOWS:
+        since = datetime.utcnow().date() - timedelta(days=WINDOWS[window] - 1)
+        query = query.filter(ScoreBucket.day >= since)
+    if course_id:
+        query = query.filter(ScoreBucket.course_id == course_id)
+    return query.group_by(ScoreBucket.user_id), total
+
+
+def window_top(window=None, course_id=None, limit=10):
+    """Return [(user_id, points)] for the top of a windowed or per-course board"""
+    query, total = _bucket_totals(window, course_id)
+    rows = query.having(total > 0).order_by(total.desc(), ScoreBucket.user_id).limit(limit).all()
+    return [(user_id, int(points)) for user_id, points in rows]
+
+
+def window_rank(user_id, window=None, course_id=None):
+    """Return (rank, points) for a user on a windowed or per-course board"""
+    query, total = _bucket_totals(window, course_id)
+    points = query.filter(ScoreBucket.user_id == user_id).one_or_none()
+    points = int(points[1]) if points else 0
+    above = query.having(total > points).subquery()
+    return db.session.query(db.func.count()).select_from(above).scalar() + 1, points
+
+
+def rebuild_score_buckets():
+    """Rebuild every bucket from the points ledger.
+
+    Opening balances are left out: they were not earned on the day they
+    were recorded.
+    """
+    from app.models.gamification import PointsEvent
+    from app.services.points import OPENING_BALANCE
+
+    day = db.func.date(PointsEvent.created_at)
+    rows = db.session.query(
+        PointsEvent.user_id, day, db.func.coalesce(PointsEvent.course_id, 0), db.func.sum(PointsEvent.points)
+    ).filter(PointsEvent.source_type != OPENING_BALANCE).group_by(PointsEvent.user_id, day, db.func.coalesce(PointsEvent.course_id, 0)).all()
+
+    ScoreBucket.query.delete()
+    buckets = []
+    for user_id, bucket_day, course_id, points in rows:
+        if isinstance(bucket_day, str):  # SQLite returns DATE() as text
+            bucket_day = date.fromisoformat(bucket_day)
+        buckets.append({'user_id': user_id, 'day': bucket_day, 'course_id': course_id, 'points': int(points)})
+    if buckets:
+        db.session.execute(db.insert(ScoreBucket), buckets)
+    return len(buckets)
+
+
+# Bumped whenever the cached LeaderboardEntry layout changes
+SNAPSHOT_VERSION = 2
+
+
+def snapshot_key(window, course_id, limit):
+    return f'leaderboard:v{SNAPSHOT_VERSION}:{window or "all"}:{course_id or 0}:{limit}'
+
+
+def invalidate_snapshots_after_commit(session, new_total, course_id=None):
+    """Queue invalidation of every snapshot a user with ``new_total`` could enter.
+
+    Windowed totals never exceed lifetime totals, so comparing the lifetime
+    total against each snapshot's lowest score is a safe test for every
+    board. Invalidation runs after commit so other workers cannot re-cache
+    the pre-award data.
+    """
+    queue_after_commit(session, 'leaderboard_invalidations', (new_total, course_id))
+
+
+@on_commit('leaderboard_invalidations')
+def _invalidate_snapshots(invalidations):
+    for new_total, course_id in set(invalidations):
+        shared_cache.invalidate_floor(new_total, course_id)
@@ -0,0 +1,56 @@
+"""Bulk level recomputation.
+
+Used after ``Config.LEVEL_THRESHOLDS`` changes, when the stored ``User.level``
+column no longer matches the curve.
+"""
+
+import time
+
+from app import db
+from app.models.user import User
+
+
+def levels_for_points(points, thresholds=None):
+    """Map a sequence of point totals to levels, computing each with User.level_for_points"""
+    return [User.level_for_points(p, thresholds) for p in points]
+
+
+def recompute_levels(chunk_size=5000, thresholds=None):
+    """Recompute User.level for every user.
+
+    Scores are read in id-ordered chunks, levels computed for the whole chunk
+    at once and only changed rows written back with an executemany UPDATE,
+    one transaction per chunk. Returns a dict of counts and throughput.
+    """
+    started = time.perf_counter()
+    scanned = changed = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(User.id, User.total_points, User.level).filter(
+            User.id > last_id
+        ).order_by(User.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        ids, points, levels = zip(*rows)
+        new_levels = levels_for_points(points, thresholds)
+        updates = [
+            {'id': user_id, 'level': new_level}
+            for user_id, level, new_level in zip(ids, levels, new_levels)
+            if level != new_level
+        ]
+        if updates:
+            db.session.execute(db.update(User), updates)
+        db.session.commit()
+
+        scanned += len(rows)
+        changed += len(updates)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'users': scanned,
+        'changed': changed,
+        'seconds': elapsed,
+        'users_per_second': scanned / elapsed if elapsed > 0 else 0.0,
+    }
@@ -0,0 +1,144 @@
+"""Points ledger.
+
+Every award is appended to ``PointsEvent`` under an idempotency key, and the
+cached ``User.total_points`` is bumped with a single atomic
+``UPDATE ... SET total_points = total_points + :points`` so concurrent
+workers never lose each other's updates.
+"""
+
+import uuid
+from datetime import datetime
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.models.gamification import PointsEvent
+from app.models.user import User
+from app.services.sql import upsert
+
+# Source type for totals carried over from before the ledger existed
+OPENING_BALANCE = 'opening_balance'
+
+
+def make_idempotency_key(user_id, source_type, source_id):
+    """Key identifying one award; awards without a source are never deduplicated"""
+    if source_id is None:
+        source_id = uuid.uuid4().hex
+    return f'{user_id}:{source_type}:{source_id}'
+
+
+def has_award(user_id, source_type, source_id):
+    """Whether the user already holds the award for a source"""
+    key = make_idempotency_key(user_id, source_type, source_id)
+    return db.session.query(PointsEvent.id).filter(PointsEvent.idempotency_key == key).first() is not None
+
+
+def award_points(user, points, source_type, source_id=None, idempotency_key=None, course_id=None):
+    """Record a points award and apply it to the user's cached total.
+
+    Returns ``(old_total, new_total)``. If an event with the same
+    idempotency key already exists, or ``points`` is zero, nothing is
+    recorded and both values are the current total.
+    """
+    current = user.total_points or 0
+    if not points:
+        return current, current
+    if idempotency_key is None:
+        idempotency_key = make_idempotency_key(user.id, source_type, source_id)
+
+    inserted = db.session.execute(
+        upsert(PointsEvent).values(
+            user_id=user.id,
+            source_type=source_type,
+            source_id=source_id,
+            course_id=course_id,
+            points=points,
+            idempotency_key=idempotency_key
+        ).on_conflict_do_nothing(index_elements=['idempotency_key'])
+    ).rowcount
+    if not inserted:
+        return current, current
+
+    now = datetime.utcnow()
+    db.session.execute(
+        db.update(User)
+        .where(User.id == user.id)
+        .values(total_points=db.func.coalesce(User.total_points, 0) + points,
+                stats_version=db.func.coalesce(User.stats_version, 0) + 1,
+                last_activity=now)
+    )
+    new_total, stats_version = db.session.query(User.total_points, User.stats_version).filter(
+        User.id == user.id
+    ).one()
+    old_total = new_total - points
+
+    # Refresh the loaded instance without marking it dirty, so a later flush
+    # cannot write a stale total back over the atomic update
+    set_committed_value(user, 'total_points', new_total)
+    set_committed_value(user, 'stats_version', stats_version)
+    set_committed_value(user, 'last_activity', now)
+    new_level = User.level_for_points(new_total)
+    if new_level != user.level:
+        db.session.execute(db.update(User).where(User.id == user.id).values(level=new_level))
+        set_committed_value(user, 'level', new_level)
+
+    from app.services.leaderboard import add_to_score_bucket, invalidate_snapshots_after_commit, update_rank_after_commit
+    add_to_score_bucket(user.id, points, course_id, now.date())
+    update_rank_after_commit(db.session(), user.id, new_total)
+    invalidate_snapshots_after_commit(db.session(), new_total, course_id)
+
+    return old_total, new_total
+
+
+def seed_opening_balances():
+    """Give users whose total predates the ledger an opening adjustment event"""
+    has_events = db.session.query(PointsEvent.id).filter(PointsEvent.user_id == User.id).exists()
+    rows = db.session.query(User.id, User.total_points).filter(
+        User.total_points != 0, ~has_events
+    ).all()
+    db.session.add_all([
+        PointsEvent(
+            user_id=user_id,
+            source_type=OPENING_BALANCE,
+            points=total,
+            idempotency_key=make_idempotency_key(user_id, OPENING_BALANCE, 'seed')
+        ) for user_id, total in rows
+    ])
+    return len(rows)
+
+
+def rebuild_totals(chunk_size=1000):
+    """Recompute cached total_points and level for every user from the ledger.
+
+    Walks users in id order, sums their events with one grouped query per
+    chunk and writes changed rows back with a bulk executemany UPDATE.
+    Returns the number of users whose cached values changed.
+    """
+    changed = 0
+    last_id = 0
+    while True:
+        users = db.session.query(User.id, User.total_points, User.level).filter(
+            User.id > last_id
+        ).order_by(User.id).limit(chunk_size).all()
+        if not users:
+            break
+        last_id = users[-1].id
+
+        sums = dict(
+            db.session.query(PointsEvent.user_id, db.func.sum(PointsEvent.points))
+            .filter(PointsEvent.user_id.between(users[0].id, last_id))
+            .group_by(PointsEvent.user_id)
+        )
+
+        updates = []
+        for user_id, total_points, level in users:
+            total = int(sums.get(user_id) or 0)
+            new_level = User.level_for_points(total)
+            if total != total_points or new_level != level:
+                updates.append({'id': user_id, 'total_points': total, 'level': new_level})
+        if updates:
+            db.session.execute(db.update(User), updates)
+        db.session.commit()
+        changed += len(updates)
+
+    return changed
@@ -0,0 +1,261 @@
+"""Enrollment progress counters.
+
+``Enrollment.completed_lessons`` and ``Enrollment.total_lessons`` are kept
+up to date incrementally: completing a lesson bumps one enrollment, and
+adding or deleting a lesson adjusts every enrollment in its course.
+``reconcile_enrollments`` recounts them from the source tables.
+
+A course is marked complete the moment its counters meet, inside the same
+transaction as the lesson completion that got it there, together with the
+course points and the ``courses_completed`` achievement check.
+``backfill_course_completions`` does the same for existing enrollments.
+
+``get_progress_for_courses`` computes the same figures directly from
+``UserProgress`` for any set of courses in a single query.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app import db
+from app.models.course import Lesson
+from app.models.user import Enrollment, User, UserProgress
+from app.services.sql import upsert
+from config import Config
+
+
+CourseProgress = namedtuple('CourseProgress', 'completed total percentage')
+
+
+def get_progress_for_courses(user, course_ids):
+    """Lesson progress for many courses in one grouped query.
+
+    Returns {course_id: CourseProgress}; courses without lessons report 0%.
+    Uses only a LEFT JOIN and GROUP BY, so it runs the same on SQLite and
+    PostgreSQL.
+    """
+    course_ids = list(set(course_ids))
+    progress = {course_id: CourseProgress(0, 0, 0) for course_id in course_ids}
+    if not course_ids:
+        return progress
+
+    user_id = getattr(user, 'id', user)
+    rows = db.session.query(
+        Lesson.course_id, db.func.count(Lesson.id), db.func.count(UserProgress.id)
+    ).outerjoin(UserProgress, db.and_(
+        UserProgress.lesson_id == Lesson.id,
+        UserProgress.user_id == user_id,
+        UserProgress.completed.is_(True)
+    )).filter(Lesson.course_id.in_(course_ids)).group_by(Lesson.course_id)
+
+    for course_id, total, completed in rows:
+        progress[course_id] = CourseProgress(completed, total, completed / total * 100 if total else 0)
+    return progress
+
+
+def count_course_lessons(course_id):
+    return db.session.query(db.func.count(Lesson.id)).filter(Lesson.course_id == course_id).scalar()
+
+
+def count_completed_lessons(user_id, course_id):
+    return db.session.query(db.func.count(UserProgress.id)).join(
+        Lesson, Lesson.id == UserProgress.lesson_id
+    ).filter(
+        UserProgress.user_id == user_id,
+        UserProgress.completed.is_(True),
+        Lesson.course_id == course_id
+    ).scalar()
+
+
+def init_enrollment_counters(enrollment):
+    """Fill in the counters for a new enrollment"""
+    enrollment.total_lessons = count_course_lessons(enrollment.course_id)
+    enrollment.completed_lessons = count_completed_lessons(enrollment.user_id, enrollment.course_id)
+
+
+def _course_is_done():
+    return db.and_(
+        Enrollment.is_completed.isnot(True),
+        Enrollment.total_lessons > 0,
+        Enrollment.completed_lessons >= Enrollment.total_lessons
+    )
+
+
+def mark_lesson_completed(user_id, lesson_id):
+    """Set the user's completion flag for a lesson, returning (progress, newly_completed).
+
+    The row is created with ``INSERT ... ON CONFLICT DO NOTHING`` and the flag
+    flipped by a conditional UPDATE, so of two concurrent completions only one
+    sees ``newly_completed`` and goes on to bump counters and award points.
+    """
+    db.session.execute(
+        upsert(UserProgress).values(user_id=user_id, lesson_id=lesson_id)
+        .on_conflict_do_nothing(index_elements=['user_id', 'lesson_id'])
+    )
+    result = db.session.execute(
+        db.update(UserProgress)
+        .where(UserProgress.user_id == user_id, UserProgress.lesson_id == lesson_id,
+               UserProgress.completed.isnot(True))
+        .values(completed=True, completed_at=datetime.utcnow())
+    )
+    progress = UserProgress.query.filter_by(user_id=user_id, lesson_id=lesson_id).populate_existing().one()
+    return progress, result.rowcount == 1
+
+
+def record_lesson_completion(user_id, course_id):
+    """Count a newly completed lesson against the user's enrollment.
+
+    Returns True if this lesson completed the course. The completion flag is
+    set by a conditional UPDATE, so only one request can ever see True.
+    """
+    db.session.execute(
+        db.update(Enrollment)
+        .where(Enrollment.user_id == user_id, Enrollment.course_id == course_id)
+        .values(completed_lessons=Enrollment.completed_lessons + 1)
+    )
+    result = db.session.execute(
+        db.update(Enrollment)
+        .where(Enrollment.user_id == user_id, Enrollment.course_id == course_id, _course_is_done())
+        .values(is_completed=True, completed_at=datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+
+def record_course_completion(user, course_id, changes):
+    """Award the points and counter for a completed course, adding them to ``changes``"""
+    old_points, new_points = user.add_points(Config.POINTS_PER_COURSE, 'course', course_id,
+                                             course_id=course_id)
+    changes['points'] = (changes.get('points', (old_points,))[0], new_points)
+    changes['courses_completed'] = user.record_course_completed()
+    return changes
+
+
+@event.listens_for(Lesson, 'after_insert')
+def _lesson_added(mapper, connection, lesson):
+    enrollment = Enrollment.__table__
+    connection.execute(
+        enrollment.update()
+        .where(enrollment.c.course_id == lesson.course_id)
+        .values(total_lessons=enrollment.c.total_lessons + 1)
+    )
+
+
+@event.listens_for(Lesson, 'before_delete')
+def _lesson_removed(mapper, connection, lesson):
+    enrollment = Enrollment.__table__
+    progress = UserProgress.__table__
+    completed_by = db.select(progress.c.user_id).where(
+        progress.c.lesson_id == lesson.id, progress.c.completed.is_(True)
+    )
+    connection.execute(
+        enrollment.update()
+        .where(enrollment.c.course_id == lesson.course_id)
+        .values(total_lessons=enrollment.c.total_lessons - 1)
+    )
+    connection.execute(
+        enrollment.update()
+        .where(enrollment.c.course_id == lesson.course_id, enrollment.c.user_id.in_(completed_by))
+        .values(completed_lessons=enrollment.c.completed_lessons - 1)
+    )
+
+
+def reconcile_enrollments(chunk_size=1000):
+    """Recount every enrollment's counters, returning how many were corrected"""
+    lesson_totals = dict(
+        db.session.query(Lesson.course_id, db.func.count(Lesson.id)).group_by(Lesson.course_id)
+    )
+
+    fixed = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(
+            Enrollment.id, Enrollment.user_id, Enrollment.course_id,
+            Enrollment.completed_lessons, Enrollment.total_lessons
+        ).filter(Enrollment.id > last_id).order_by(Enrollment.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        user_ids = {row.user_id for row in rows}
+        completed = {
+            (user_id, course_id): count
+            for user_id, course_id, count in db.session.query(
+                UserProgress.user_id, Lesson.course_id, db.func.count(UserProgress.id)
+            ).join(Lesson, Lesson.id == UserProgress.lesson_id).filter(
+                UserProgress.user_id.in_(user_ids), UserProgress.completed.is_(True)
+            ).group_by(UserProgress.user_id, Lesson.course_id)
+        }
+
+        updates = []
+        for enrollment_id, user_id, course_id, completed_lessons, total_lessons in rows:
+            new_completed = completed.get((user_id, course_id), 0)
+            new_total = lesson_totals.get(course_id, 0)
+            if (new_completed, new_total) != (completed_lessons, total_lessons):
+                updates.append({'id': enrollment_id, 'completed_lessons': new_completed, 'total_lessons': new_total})
+        if updates:
+            db.session.execute(db.update(Enrollment), updates)
+        db.session.commit()
+        fixed += len(updates)
+    return fixed
+
+
+def backfill_course_completions(chunk_size=1000):
+    """Mark every enrollment whose counters show it finished as completed.
+
+    Works through enrollments in id-ordered chunks, one transaction each,
+    using the time of the last completed lesson as ``completed_at``. Users'
+    ``courses_completed`` counters are then recounted and any
+    ``courses_completed`` achievements awarded. No points are awarded, so a
+    backfill does not reshuffle the weekly leaderboards. Run
+    ``reconcile_enrollments`` first if the counters may have drifted.
+    Returns the number of enrollments marked complete.
+    """
+    from app.services.achievements import award_achievements
+
+    marked = 0
+    touched_users = set()
+    last_id = 0
+    while True:
+        rows = db.session.query(Enrollment.id, Enrollment.user_id, Enrollment.course_id).filter(
+            Enrollment.id > last_id, _course_is_done()
+        ).order_by(Enrollment.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        user_ids = {row.user_id for row in rows}
+        finished_at = {
+            (user_id, course_id): completed_at
+            for user_id, course_id, completed_at in db.session.query(
+                UserProgress.user_id, Lesson.course_id, db.func.max(UserProgress.completed_at)
+            ).join(Lesson, Lesson.id == UserProgress.lesson_id).filter(
+                UserProgress.user_id.in_(user_ids), UserProgress.completed.is_(True)
+            ).group_by(UserProgress.user_id, Lesson.course_id)
+        }
+        now = datetime.utcnow()
+        db.session.execute(db.update(Enrollment), [
+            {'id': enrollment_id, 'is_completed': True,
+             'completed_at': finished_at.get((user_id, course_id)) or now}
+            for enrollment_id, user_id, course_id in rows
+        ])
+        db.session.commit()
+        marked += len(rows)
+        touched_users.update(user_ids)
+
+    touched_users = sorted(touched_users)
+    for start in range(0, len(touched_users), chunk_size):
+        user_ids = touched_users[start:start + chunk_size]
+        counts = dict(
+            db.session.query(Enrollment.user_id, db.func.count(Enrollment.id))
+            .filter(Enrollment.user_id.in_(user_ids), Enrollment.is_completed.is_(True))
+            .group_by(Enrollment.user_id)
+        )
+        for user in User.query.filter(User.id.in_(user_ids)):
+            old_count, new_count = user.courses_completed or 0, counts.get(user.id, 0)
+            if new_count != old_count:
+                user.courses_completed = new_count
+                award_achievements(user, {'courses_completed': (old_count, new_count)})
+        db.session.commit()
+    return marked
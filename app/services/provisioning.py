@@ -0,0 +1,289 @@
+"""Bulk user provisioning.
+
+Schools onboard whole cohorts at once, so an import file of users and course
+assignments is applied in a handful of statements rather than one
+registration and one enrollment request per student: existing usernames and
+emails are resolved in one query, passwords are hashed on a process pool and
+users and enrollments are written with executemany inserts, one transaction
+per chunk.
+
+Import files are CSV with a header row or NDJSON (one JSON object per line)
+with the fields ``username``, ``email``, ``first_name``, ``last_name``,
+``password``, optional ``role`` and optional ``courses`` (course ids, ``;``
+separated in CSV or a list in NDJSON). Rows for users that already exist only
+add their course assignments, so re-running a partly applied file is safe.
+
+Imports uploaded through the admin API run as background jobs, so hashing a
+large cohort never holds a request open. Their results are kept in the shared
+cache, so any worker can report them.
+"""
+
+import csv
+import io
+import json
+import os
+import threading
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.models.course import Course, Lesson
+from app.models.user import Enrollment, User, UserProgress
+from app.services.cache import delete_after_commit, shared_cache
+from app.services.enrollments import enrollments_key
+
+IMPORT_JOB_TTL = 86400
+
+ImportRow = namedtuple('ImportRow', 'line username email first_name last_name password role course_ids')
+
+REQUIRED_FIELDS = ('username', 'email', 'first_name', 'last_name', 'password')
+IMPORT_ROLES = ('student', 'educator')
+
+
+def _course_ids(value):
+    if value in (None, ''):
+        return ()
+    if isinstance(value, str):
+        value = [part for part in value.replace(',', ';').split(';') if part.strip()]
+    return tuple(int(course_id) for course_id in value)
+
+
+def _records(stream, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_num, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield line_num, json.loads(line)
+                except ValueError:
+                    yield line_num, None
+    else:
+        raise ValueError(f'Unsupported import format: {fmt}')
+
+
+def parse_import(stream, fmt):
+    """Read an import file, returning (rows, errors); errors are (line, message)"""
+    if isinstance(stream, (bytes, str)):
+        stream = io.StringIO(stream.decode('utf-8-sig') if isinstance(stream, bytes) else stream)
+
+    rows, errors = [], []
+    for line, record in _records(stream, fmt):
+        if not isinstance(record, dict):
+            errors.append((line, 'Not a JSON object'))
+            continue
+        values = {field: str(record.get(field) or '').strip() for field in REQUIRED_FIELDS}
+        missing = [field for field in REQUIRED_FIELDS if not values[field]]
+        if missing:
+            errors.append((line, f"Missing {', '.join(missing)}"))
+            continue
+        role = str(record.get('role') or 'student').strip()
+        if role not in IMPORT_ROLES:
+            errors.append((line, f'Invalid role {role}'))
+            continue
+        try:
+            course_ids = _course_ids(record.get('courses'))
+        except (TypeError, ValueError):
+            errors.append((line, 'Invalid course list'))
+            continue
+        rows.append(ImportRow(line, values['username'], values['email'].lower(), values['first_name'],
+                              values['last_name'], values['password'], role, course_ids))
+    return rows, errors
+
+
+def format_for_filename(filename, default='csv'):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}.get(ext, default)
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash passwords in parallel; the hash is deliberately slow, so it is CPU bound.
+
+    The process pool forks the caller, so only the CLI uses it; web workers
+    hold database connections and other threads and pass ``workers=1``.
+    """
+    passwords = list(passwords)
+    if workers == 1 or len(passwords) < 2:
+        return [generate_password_hash(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(len(passwords) // ((workers or os.cpu_count() or 1) * 4), 1)
+        return list(pool.map(generate_password_hash, passwords, chunksize=chunksize))
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def import_users(rows, chunk_size=500, workers=None):
+    """Create missing users and enroll everyone in their assigned courses.
+
+    Returns a dict of counts plus a list of (line, message) for rows that
+    were skipped.
+    """
+    stats = {'created': 0, 'existing': 0, 'enrollments': 0, 'errors': []}
+
+    # Later rows for the same username/email in one file are duplicates
+    seen_usernames, seen_emails, unique_rows = {}, {}, []
+    for row in rows:
+        if row.username in seen_usernames or row.email in seen_emails:
+            first = seen_usernames.get(row.username) or seen_emails.get(row.email)
+            if (first.username, first.email) != (row.username, row.email):
+                stats['errors'].append((row.line, f'Conflicts with line {first.line}'))
+                continue
+        seen_usernames.setdefault(row.username, row)
+        seen_emails.setdefault(row.email, row)
+        unique_rows.append(row)
+
+    existing = {}
+    existing_emails = {}
+    if unique_rows:
+        for user_id, username, email in db.session.query(User.id, User.username, User.email).filter(
+            db.or_(User.username.in_(list(seen_usernames)), db.func.lower(User.email).in_(list(seen_emails)))
+        ):
+            existing[username] = user_id
+            existing_emails[email.lower()] = username
+
+    new_rows, existing_rows, pending = [], [], set()
+    for row in unique_rows:
+        if row.username in existing:
+            if existing_emails.get(row.email, row.username) != row.username:
+                stats['errors'].append((row.line, 'Email belongs to another user'))
+            else:
+                existing_rows.append(row)
+        elif row.email in existing_emails:
+            stats['errors'].append((row.line, 'Email already registered'))
+        elif row.username not in pending:
+            pending.add(row.username)
+            new_rows.append(row)
+        else:
+            existing_rows.append(row)
+
+    stats['existing'] = len({row.username for row in existing_rows if row.username in existing})
+
+    course_ids = {course_id for row in new_rows + existing_rows for course_id in row.course_ids}
+    lesson_totals = {}
+    if course_ids:
+        known = {course_id for (course_id,) in db.session.query(Course.id).filter(Course.id.in_(course_ids))}
+        for row in new_rows + existing_rows:
+            unknown = [course_id for course_id in row.course_ids if course_id not in known]
+            if unknown:
+                stats['errors'].append((row.line, f"Unknown course {', '.join(map(str, unknown))}"))
+        lesson_totals = dict(
+            db.session.query(Lesson.course_id, db.func.count(Lesson.id))
+            .filter(Lesson.course_id.in_(known)).group_by(Lesson.course_id)
+        )
+        course_ids = known
+
+    hashes = hash_passwords((row.password for row in new_rows), workers)
+
+    for chunk in _chunks(list(zip(new_rows, hashes)), chunk_size):
+        db.session.execute(db.insert(User), [{
+            'username': row.username,
+            'email': row.email,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'password_hash': password_hash,
+            'role': row.role,
+        } for row, password_hash in chunk])
+        usernames = [row.username for row, _ in chunk]
+        existing.update(db.session.query(User.username, User.id).filter(User.username.in_(usernames)))
+        stats['created'] += len(chunk)
+        stats['enrollments'] += _enroll(
+            [row for row, _ in chunk], existing, course_ids, lesson_totals, new_users=True
+        )
+        db.session.commit()
+
+    for chunk in _chunks(existing_rows, chunk_size):
+        stats['enrollments'] += _enroll(chunk, existing, course_ids, lesson_totals, new_users=False)
+        db.session.commit()
+
+    return stats
+
+
+def _enroll(rows, user_ids, course_ids, lesson_totals, new_users):
+    """Insert the missing enrollments for one chunk of rows"""
+    pairs = {(user_ids[row.username], course_id)
+             for row in rows for course_id in row.course_ids if course_id in course_ids}
+    if not pairs:
+        return 0
+
+    chunk_user_ids = {user_id for user_id, _ in pairs}
+    completed = {}
+    if not new_users:
+        pairs -= set(db.session.query(Enrollment.user_id, Enrollment.course_id).filter(
+            Enrollment.user_id.in_(chunk_user_ids)
+        ))
+        completed = {
+            (user_id, course_id): count
+            for user_id, course_id, count in db.session.query(
+                UserProgress.user_id, Lesson.course_id, db.func.count(UserProgress.id)
+            ).join(Lesson, Lesson.id == UserProgress.lesson_id).filter(
+                UserProgress.user_id.in_(chunk_user_ids), UserProgress.completed.is_(True)
+            ).group_by(UserProgress.user_id, Lesson.course_id)
+        }
+        if not pairs:
+            return 0
+
+    db.session.execute(db.insert(Enrollment), [{
+        'user_id': user_id,
+        'course_id': course_id,
+        'completed_lessons': completed.get((user_id, course_id), 0),
+        'total_lessons': lesson_totals.get(course_id, 0),
+    } for user_id, course_id in sorted(pairs)])
+
+    # Bulk inserts skip the mapper events that normally drop cached enrollment sets
+    delete_after_commit(db.session, *(enrollments_key(user_id) for user_id in {u for u, _ in pairs}))
+    return len(pairs)
+
+
+def import_job_key(job_id):
+    return f'import:{job_id}'
+
+
+def start_import_job(rows, errors=()):
+    """Run ``import_users`` in a background thread, returning the job id.
+
+    Passwords are hashed in that thread without a process pool; the hash
+    functions release the GIL, so request threads keep running.
+
+    The job's state is stored under ``import_job_key(job_id)``: ``running``
+    until it finishes, then ``done`` with the counts and errors, or
+    ``failed`` with a message (chunks committed before the failure stay).
+    """
+    job_id = uuid.uuid4().hex
+    shared_cache.set(import_job_key(job_id), {'status': 'running', 'rows': len(rows)}, IMPORT_JOB_TTL)
+    threading.Thread(target=_run_import_job, name=f'import-{job_id}', daemon=True,
+                     args=(current_app._get_current_object(), job_id, rows, list(errors))).start()
+    return job_id
+
+
+def _run_import_job(app, job_id, rows, errors):
+    with app.app_context():
+        try:
+            stats = import_users(rows, workers=1)
+            result = {
+                'status': 'done',
+                'created': stats['created'],
+                'existing': stats['existing'],
+                'enrollments': stats['enrollments'],
+                'errors': [{'line': line, 'message': message}
+                           for line, message in sorted(errors + stats['errors'])],
+            }
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('User import %s failed', job_id)
+            result = {'status': 'failed', 'message': str(e)}
+        finally:
+            db.session.remove()
+        shared_cache.set(import_job_key(job_id), result, IMPORT_JOB_TTL)
+
+
+def get_import_job(job_id):
+    return shared_cache.get(import_job_key(job_id))
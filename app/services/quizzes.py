@@ -0,0 +1,165 @@
+"""Quiz grading.
+
+Each quiz is compiled into an answer key, a question_id -> correct answer_id
+mapping built with one query. Keys are cached per worker under the quiz's
+shared version number, which is bumped after any commit that touches the
+quiz's questions or answers, so grading a submission is a pure in-memory pass.
+Both submit endpoints grade through ``grade_quiz``.
+
+Rendering uses a ``QuizBundle``: the quiz with its ordered questions and
+answers, loaded in two queries and cached the same way. Bundles never carry
+``is_correct``, so templates cannot leak the answer key.
+"""
+
+import threading
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.course import Answer, Question, Quiz
+from app.services.cache import shared_cache
+from app.services.commit_hooks import on_commit, queue_after_commit
+
+AnswerKey = namedtuple('AnswerKey', 'quiz_id version question_ids correct')
+GradeResult = namedtuple('GradeResult', 'score total_questions percentage correct_answer_ids')
+
+QuizBundle = namedtuple('QuizBundle', 'id title course_id version questions')
+QuestionView = namedtuple('QuestionView', 'id text order answers')
+AnswerView = namedtuple('AnswerView', 'id text')
+
+_lock = threading.Lock()
+_answer_keys = {}
+_bundles = {}
+
+
+def quiz_version_key(quiz_id):
+    return f'quiz:{quiz_id}'
+
+
+def get_quiz_version(quiz_id):
+    return shared_cache.get_version(quiz_version_key(quiz_id))
+
+
+def compile_answer_key(quiz_id, version):
+    rows = db.session.query(Question.id, db.func.min(Answer.id)).outerjoin(
+        Answer, db.and_(Answer.question_id == Question.id, Answer.is_correct.is_(True))
+    ).filter(Question.quiz_id == quiz_id).group_by(Question.id, Question.order).order_by(
+        Question.order, Question.id
+    ).all()
+    return AnswerKey(
+        quiz_id,
+        version,
+        tuple(question_id for question_id, _ in rows),
+        {question_id: answer_id for question_id, answer_id in rows if answer_id is not None}
+    )
+
+
+def get_answer_key(quiz_id):
+    version = get_quiz_version(quiz_id)
+    key = _answer_keys.get(quiz_id)
+    if key is None or key.version != version:
+        key = compile_answer_key(quiz_id, version)
+        with _lock:
+            _answer_keys[quiz_id] = key
+    return key
+
+
+def load_quiz_bundle(quiz_id, version):
+    """Load a quiz, its questions and their answers in two queries; None if missing"""
+    quiz = db.session.query(Quiz.id, Quiz.title, Quiz.course_id).filter(Quiz.id == quiz_id).first()
+    if quiz is None:
+        return None
+
+    rows = db.session.query(Question.id, Question.text, Question.order, Answer.id, Answer.text).outerjoin(
+        Answer, Answer.question_id == Question.id
+    ).filter(Question.quiz_id == quiz_id).order_by(Question.order, Question.id, Answer.id).all()
+
+    questions = []
+    for question_id, text, order, answer_id, answer_text in rows:
+        if not questions or questions[-1][0] != question_id:
+            questions.append((question_id, text, order, []))
+        if answer_id is not None:
+            questions[-1][3].append(AnswerView(answer_id, answer_text))
+
+    return QuizBundle(quiz.id, quiz.title, quiz.course_id, version, tuple(
+        QuestionView(question_id, text, order, tuple(answers))
+        for question_id, text, order, answers in questions
+    ))
+
+
+def get_quiz_bundle(quiz_id):
+    """Render-ready quiz structure, reused until the quiz is edited"""
+    version = get_quiz_version(quiz_id)
+    bundle = _bundles.get(quiz_id)
+    if bundle is None or bundle.version != version:
+        bundle = load_quiz_bundle(quiz_id, version)
+        if bundle is None:
+            return None
+        with _lock:
+            _bundles[quiz_id] = bundle
+    return bundle
+
+
+def parse_answer_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def grade_quiz(quiz_id, selected):
+    """Grade a submission.
+
+    ``selected`` maps question ids to the chosen answer id; keys and values
+    may be ints or strings. Unanswered or malformed entries count as wrong.
+    """
+    key = get_answer_key(quiz_id)
+    selected = {parse_answer_id(q): parse_answer_id(a) for q, a in selected.items()}
+
+    correct_answer_ids = []
+    for question_id in key.question_ids:
+        correct = key.correct.get(question_id)
+        if correct is not None and selected.get(question_id) == correct:
+            correct_answer_ids.append(correct)
+
+    score = len(correct_answer_ids)
+    total = len(key.question_ids)
+    percentage = (score / total) * 100 if total > 0 else 0
+    return GradeResult(score, total, percentage, correct_answer_ids)
+
+
+def _queue_quiz_change(session, quiz_id):
+    if quiz_id is not None:
+        queue_after_commit(session, 'changed_quizzes', quiz_id)
+
+
+def _question_changed(mapper, connection, question):
+    _queue_quiz_change(Session.object_session(question), question.quiz_id)
+
+
+def _answer_changed(mapper, connection, answer):
+    question = Question.__table__
+    quiz_id = connection.execute(
+        db.select(question.c.quiz_id).where(question.c.id == answer.question_id)
+    ).scalar()
+    _queue_quiz_change(Session.object_session(answer), quiz_id)
+
+
+def _quiz_changed(mapper, connection, quiz):
+    _queue_quiz_change(Session.object_session(quiz), quiz.id)
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Question, _event, _question_changed)
+    event.listen(Answer, _event, _answer_changed)
+    event.listen(Quiz, _event, _quiz_changed)
+
+
+@on_commit('changed_quizzes')
+def _publish_quiz_changes(quiz_ids):
+    for quiz_id in set(quiz_ids):
+        _answer_keys.pop(quiz_id, None)
+        _bundles.pop(quiz_id, None)
+        shared_cache.bump_version(quiz_version_key(quiz_id))
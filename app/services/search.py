@@ -0,0 +1,439 @@
+"""Ranked full-text search over courses and lessons.
+
+Course titles and descriptions and lesson titles and content are tokenized
+into an in-process inverted index and ranked with BM25, so a search costs
+one dictionary lookup per query term instead of a ``LIKE '%q%'`` scan over
+every lesson body. Query terms the index has never seen are matched against
+similar indexed terms through a trigram index (``app.services.trigrams``),
+so "renewabel" still finds "renewable". The index also keeps each document's
+plain text and the character offsets of its body terms, so result snippets
+are cut around the matches without re-reading or re-scanning the content.
+
+Each worker loads the index from a gzipped JSON snapshot
+(``SEARCH_INDEX_PATH``) on first use, or builds it from the database and
+writes the snapshot when there is none. Content changes are published after
+commit as numbered entries in a journal kept in the shared cache; before
+every search a worker replays the entries it has not seen, re-reading just
+the documents they name. If the journal has gaps, or the index no longer
+matches the database's document counts, the index is rebuilt.
+
+This is the default backend of ``app.services.search_backends``.
+"""
+
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from collections import Counter, namedtuple
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.course import Course, Lesson
+from app.services.cache import shared_cache
+from app.services.commit_hooks import on_commit, queue_after_commit
+from app.services.trigrams import TrigramIndex
+from config import Config
+
+SNAPSHOT_FORMAT = 2
+JOURNAL_KEY = 'search'
+TITLE_WEIGHT = 3  # a title token counts as this many body tokens
+K1, B = 1.2, 0.75
+MIN_FUZZY_LENGTH = 4  # shorter misspellings match too many unrelated terms
+SNIPPET_LENGTH = 150
+
+TAG_RE = re.compile(r'<[^>]+>')
+TOKEN_RE = re.compile(r'\w+')
+
+Document = namedtuple('Document', 'kind id course_id title length')
+SearchHit = namedtuple('SearchHit', 'kind id course_id title score')
+Snippet = namedtuple('Snippet', 'text highlights')  # highlights: [(start, end)] offsets into text
+
+
+def strip_tags(text):
+    return TAG_RE.sub(' ', text or '')
+
+
+def plain_text(text):
+    """Text without markup and with whitespace collapsed"""
+    return ' '.join(strip_tags(text).split())
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(strip_tags(text))]
+
+
+def term_offsets(text):
+    """{term: [character offsets]} for plain text"""
+    offsets = {}
+    for match in TOKEN_RE.finditer(text):
+        offsets.setdefault(match.group().lower(), []).append(match.start())
+    return offsets
+
+
+def document_terms(title, offsets):
+    counts = Counter({term: len(starts) for term, starts in offsets.items()})
+    for term in tokenize(title):
+        counts[term] += TITLE_WEIGHT
+    return counts
+
+
+def make_snippet(text, offsets, weights, length=SNIPPET_LENGTH):
+    """Window of ``text`` holding the best-weighted set of query term matches.
+
+    ``offsets`` maps terms to their character offsets in ``text`` and
+    ``weights`` maps the query's terms to their weights. The window covers
+    the most total weight of distinct terms, then the most matches, and is
+    trimmed to whole words; highlight offsets account for the ellipses.
+    """
+    hits = sorted((start, term) for term in weights for start in offsets.get(term, ()))
+    best, best_score = None, None
+    seen = Counter()
+    first = 0
+    for last, (start, term) in enumerate(hits):
+        seen[term] += 1
+        while first < last and start + len(term) - hits[first][0] > length:
+            dropped = hits[first][1]
+            seen[dropped] -= 1
+            if not seen[dropped]:
+                del seen[dropped]
+            first += 1
+        score = (sum(weights[matched] for matched in seen), last - first)
+        if best_score is None or score > best_score:
+            best, best_score = (first, last), score
+
+    span_start = span_end = 0
+    if best is not None:
+        span_start = hits[best[0]][0]
+        span_end = hits[best[1]][0] + len(hits[best[1]][1])
+    if span_end - span_start > length:
+        # A single term longer than the window: show its start
+        begin, end = span_start, span_start + length
+    else:
+        # Centre the matches, then trim partial words at either edge
+        begin = max(0, span_start - (length - (span_end - span_start)) // 2)
+        end = min(len(text), begin + length)
+        begin = max(0, end - length)
+        if begin and text[begin - 1] != ' ':
+            space = text.find(' ', begin, span_start)
+            begin = space + 1 if space != -1 else begin
+        if end < len(text) and text[end] != ' ':
+            space = text.rfind(' ', span_end, end)
+            end = space if space != -1 else end
+
+    prefix = '...' if begin else ''
+    suffix = '...' if end < len(text) else ''
+    shift = len(prefix) - begin
+    highlights = [(max(start, begin) + shift, min(start + len(term), end) + shift) for start, term in hits
+                  if start < end and start + len(term) > begin]
+    return Snippet(prefix + text[begin:end] + suffix, highlights)
+
+
+class InvertedIndex:
+    """Term -> {(kind, id): term frequency} postings with BM25 ranking"""
+
+    def __init__(self, seq=0):
+        self.docs = {}
+        self.postings = {}
+        self.doc_terms = {}
+        self.texts = {}
+        self.positions = {}  # (kind, id) -> (term bounds, offsets), in doc_terms order
+        self.trigrams = TrigramIndex()
+        self.total_length = 0
+        self.seq = seq  # last journal entry applied
+        self.pending = set()  # documents changed by this worker, not yet re-read
+        self.missing = None  # (journal seq, monotonic time) first found missing
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def waited_for(self, seq):
+        """Seconds since journal entry ``seq`` was first found missing"""
+        now = time.monotonic()
+        if self.missing is None or self.missing[0] != seq:
+            self.missing = (seq, now)
+        return now - self.missing[1]
+
+    def add(self, kind, doc_id, course_id, title, body):
+        text = plain_text(body)
+        offsets = term_offsets(text)
+        counts = document_terms(title, offsets)
+        key = (kind, doc_id)
+        with self._lock:
+            self.remove(kind, doc_id)
+            length = sum(counts.values())
+            self.docs[key] = Document(kind, doc_id, course_id, title, length)
+            self.doc_terms[key] = terms = tuple(counts)
+            self.texts[key] = text
+            # One flat array per document; term i's offsets are offsets[bounds[i]:bounds[i + 1]]
+            bounds, flat = array('I', [0]), array('I')
+            for term in terms:
+                flat.extend(offsets.get(term, ()))
+                bounds.append(len(flat))
+            self.positions[key] = (bounds, flat)
+            self.total_length += length
+            for term, tf in counts.items():
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    if not term.isdigit():
+                        self.trigrams.add(term)
+                self.postings[term][key] = tf
+
+    def remove(self, kind, doc_id):
+        key = (kind, doc_id)
+        with self._lock:
+            doc = self.docs.pop(key, None)
+            if doc is None:
+                return
+            self.total_length -= doc.length
+            del self.texts[key], self.positions[key]
+            for term in self.doc_terms.pop(key):
+                postings = self.postings[term]
+                del postings[key]
+                if not postings:
+                    del self.postings[term]
+                    self.trigrams.remove(term)
+
+    def query_terms(self, query, fuzzy=True):
+        """{indexed term: weight} for a query; unknown terms map to similar terms weighted by similarity"""
+        weights = {}
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                weights[term] = max(weights.get(term, 0.0), 1.0)
+            elif fuzzy and len(term) >= MIN_FUZZY_LENGTH and not term.isdigit():
+                for match, score in self.trigrams.similar(term, Config.SEARCH_FUZZY_THRESHOLD,
+                                                          Config.SEARCH_FUZZY_MAX_EXPANSIONS):
+                    weights[match] = max(weights.get(match, 0.0), score)
+        return weights
+
+    def search(self, query, kinds=None, limit=None, fuzzy=True):
+        """BM25-ranked hits for any of the query's terms, best first"""
+        with self._lock:
+            if not self.docs:
+                return []
+            terms = self.query_terms(query, fuzzy)
+            n_docs = len(self.docs)
+            avg_length = self.total_length / n_docs
+            scores = {}
+            for term, weight in terms.items():
+                postings = self.postings[term]
+                idf = weight * math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    if kinds and key[0] not in kinds:
+                        continue
+                    norm = K1 * (1 - B + B * self.docs[key].length / avg_length)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+
+            order = lambda item: (-item[1], item[0])
+            ranked = heapq.nsmallest(limit, scores.items(), key=order) if limit else sorted(scores.items(), key=order)
+            return [SearchHit(key[0], key[1], self.docs[key].course_id, self.docs[key].title, score)
+                    for key, score in ranked]
+
+    def offsets(self, key, terms):
+        """{term: character offsets in the document's text} for the given terms"""
+        doc_terms = self.doc_terms[key]
+        bounds, flat = self.positions[key]
+        found = {}
+        for term in terms:
+            try:
+                i = doc_terms.index(term)
+            except ValueError:
+                continue
+            found[term] = flat[bounds[i]:bounds[i + 1]]
+        return found
+
+    def snippets(self, query, hits, length=SNIPPET_LENGTH):
+        """{(kind, id): Snippet} around the query's matches in each hit still in the index"""
+        with self._lock:
+            weights = self.query_terms(query)
+            snippets = {}
+            for hit in hits:
+                key = (hit.kind, hit.id)
+                if key in self.docs:
+                    snippets[key] = make_snippet(self.texts[key], self.offsets(key, weights), weights, length)
+            return snippets
+
+    def counts(self):
+        """(courses, max course id, lessons, max lesson id) held in the index"""
+        with self._lock:
+            ids = {'course': [], 'lesson': []}
+            for kind, doc_id in self.docs:
+                ids[kind].append(doc_id)
+        return (len(ids['course']), max(ids['course'], default=0),
+                len(ids['lesson']), max(ids['lesson'], default=0))
+
+    def to_snapshot(self):
+        # Postings and offsets are re-derived from the plain text on load
+        with self._lock:
+            return {
+                'format': SNAPSHOT_FORMAT,
+                'seq': self.seq,
+                'docs': [[doc.kind, doc.id, doc.course_id, doc.title, self.texts[key]]
+                         for key, doc in self.docs.items()],
+            }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        index = cls(snapshot['seq'])
+        for kind, doc_id, course_id, title, text in snapshot['docs']:
+            index.add(kind, doc_id, course_id, title, text)
+        return index
+
+
+def snapshot_path():
+    return current_app.config.get('SEARCH_INDEX_PATH')
+
+
+def save_snapshot(index, path=None):
+    path = path or snapshot_path()
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        json.dump(index.to_snapshot(), f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def load_snapshot(path=None):
+    """The saved index, or None if there is no usable snapshot"""
+    path = path or snapshot_path()
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        return None
+    return InvertedIndex.from_snapshot(snapshot)
+
+
+def _load_documents(index, kind, ids=None):
+    """Index the given documents of one kind (all of them if ids is None); returns the ids found"""
+    if kind == 'course':
+        query = db.session.query(Course.id, Course.id, Course.title, Course.description)
+        id_column = Course.id
+    else:
+        query = db.session.query(Lesson.id, Lesson.course_id, Lesson.title, Lesson.content)
+        id_column = Lesson.id
+    if ids is not None:
+        query = query.filter(id_column.in_(ids))
+    found = set()
+    for doc_id, course_id, title, body in query.yield_per(500):
+        index.add(kind, doc_id, course_id, title, body)
+        found.add(doc_id)
+    return found
+
+
+def build_index():
+    """Index every course and lesson from the database and save a snapshot"""
+    index = InvertedIndex(shared_cache.get_version(JOURNAL_KEY) or 0)
+    for kind in ('course', 'lesson'):
+        _load_documents(index, kind)
+    save_snapshot(index)
+    return index
+
+
+def content_counts():
+    course_count, course_max = db.session.query(db.func.count(Course.id), db.func.max(Course.id)).one()
+    lesson_count, lesson_max = db.session.query(db.func.count(Lesson.id), db.func.max(Lesson.id)).one()
+    return course_count, course_max or 0, lesson_count, lesson_max or 0
+
+
+def reindex(index, keys):
+    """Re-read the named documents, dropping any that no longer exist"""
+    for kind in ('course', 'lesson'):
+        ids = {doc_id for key_kind, doc_id in keys if key_kind == kind}
+        if ids:
+            for doc_id in ids - _load_documents(index, kind, ids):
+                index.remove(kind, doc_id)
+
+
+def sync_index(index):
+    """Apply journal entries published since the index was built.
+
+    The journal version is bumped before its entry is written, so a missing
+    entry is first treated as still in flight: replay stops before it and
+    the next call retries. Only an entry missing for longer than
+    ``SEARCH_JOURNAL_WAIT_SECONDS`` is a gap.
+
+    Returns the index to use, which is a fresh build if the journal cannot
+    bring this one up to date.
+    """
+    version = shared_cache.get_version(JOURNAL_KEY) or 0
+    changed = set(index.pending)
+    if version != index.seq:
+        if version < index.seq or version - index.seq > Config.SEARCH_JOURNAL_MAX_REPLAY:
+            return build_index()
+        for seq in range(index.seq + 1, version + 1):
+            entry = shared_cache.get(f'{JOURNAL_KEY}:{seq}')
+            if entry is None:
+                if index.waited_for(seq) < Config.SEARCH_JOURNAL_WAIT_SECONDS:
+                    version = seq - 1
+                    break
+                return build_index()
+            changed.update((kind, doc_id) for kind, doc_id in entry)
+    if changed:
+        index.pending.difference_update(changed)
+        reindex(index, changed)
+    index.seq = version
+    return index
+
+
+_index = None
+_index_owner = None
+_index_lock = threading.Lock()
+
+
+def _owner():
+    # One index per worker process and database
+    return os.getpid(), id(db.engine)
+
+
+def get_search_index():
+    """This worker's index, loaded on first use and synced with the journal"""
+    global _index, _index_owner
+    with _index_lock:
+        if _index is None or _index_owner != _owner():
+            index = load_snapshot()
+            if index is not None:
+                index = sync_index(index)
+                if index.counts() != content_counts():
+                    index = build_index()
+            else:
+                index = build_index()
+            _index, _index_owner = index, _owner()
+        else:
+            _index = sync_index(_index)
+        return _index
+
+
+def _mark_document_changed(kind):
+    def listener(mapper, connection, target):
+        queue_after_commit(Session.object_session(target), 'search_changes', (kind, target.id))
+    return listener
+
+
+for _model, _kind in ((Course, 'course'), (Lesson, 'lesson')):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _mark_document_changed(_kind))
+
+
+@on_commit('search_changes')
+def _publish_search_changes(changes):
+    changes = set(changes)
+    if _index is not None and _index_owner == _owner():
+        _index.pending.update(changes)
+    seq = shared_cache.bump_version(JOURNAL_KEY)
+    if seq is not None:
+        shared_cache.set(f'{JOURNAL_KEY}:{seq}', sorted(changes), Config.SEARCH_JOURNAL_TTL)
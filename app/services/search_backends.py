@@ -0,0 +1,350 @@
+"""Search backends.
+
+``api.search`` and the course listing call ``search`` here, which runs the
+query through the backend named by ``SEARCH_BACKEND``:
+
+``index``
+    The in-process BM25 index from ``app.services.search`` (default). The
+    only backend that matches misspelled terms.
+``sqlite_fts``
+    An FTS5 virtual table in the application's SQLite database.
+``postgres_fts``
+    A ``search_document`` table with a generated ``tsvector`` column and a
+    GIN index.
+``like``
+    The original ``LIKE '%q%'`` matching, kept as the reference behaviour
+    for correctness checks. Hits come back in id order with a score of 0.
+
+The two database backends keep their tables in step through ORM hooks on
+``Course`` and ``Lesson`` that write in the same transaction as the change.
+Their tables are created by ``db.create_all`` or, failing that, on the first
+search, and filled from the content tables when created; ``flask
+rebuild-search-index`` repopulates them. Backends other than ``index`` keep
+no term offsets and cut result snippets from the content rows.
+"""
+
+import threading
+
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, event, text
+
+from app import db
+from app.models.course import Course, Lesson
+from app.services.search import (
+    SearchHit, build_index, get_search_index, make_snippet, plain_text, strip_tags, term_offsets, tokenize,
+)
+
+
+def _kinds_filter(kinds):
+    return ' AND kind IN :kinds' if kinds else ''
+
+
+def _bind(statement, kinds):
+    statement = text(statement)
+    if kinds:
+        statement = statement.bindparams(bindparam('kinds', expanding=True))
+    return statement
+
+
+def iter_documents(connection, chunk_size=500):
+    """(kind, id, course_id, title, body) for every course and lesson, bodies without markup"""
+    for kind, statement in (
+        ('course', db.select(Course.id, Course.id, Course.title, Course.description)),
+        ('lesson', db.select(Lesson.id, Lesson.course_id, Lesson.title, Lesson.content)),
+    ):
+        for rows in connection.execute(statement).partitions(chunk_size):
+            for doc_id, course_id, title, body in rows:
+                yield kind, doc_id, course_id, title, strip_tags(body)
+
+
+def content_snippets(query, hits):
+    """Snippets cut from the hits' content rows, for backends that keep no term offsets"""
+    weights = dict.fromkeys(tokenize(query), 1.0)
+    snippets = {}
+    for kind, model, column in (('course', Course, Course.description), ('lesson', Lesson, Lesson.content)):
+        ids = [hit.id for hit in hits if hit.kind == kind]
+        if not ids:
+            continue
+        for doc_id, body in db.session.query(model.id, column).filter(model.id.in_(ids)):
+            text = plain_text(body)
+            snippets[(kind, doc_id)] = make_snippet(text, term_offsets(text), weights)
+    return snippets
+
+
+class IndexBackend:
+    """In-process inverted index"""
+
+    name = 'index'
+
+    def search(self, query, kinds=None, limit=None):
+        return get_search_index().search(query, kinds, limit)
+
+    def snippets(self, query, hits):
+        return get_search_index().snippets(query, hits)
+
+    def rebuild(self):
+        return len(build_index())
+
+
+class LikeBackend:
+    """Substring matching with LIKE; unranked reference implementation"""
+
+    name = 'like'
+
+    def search(self, query, kinds=None, limit=None):
+        hits = []
+        if not kinds or 'course' in kinds:
+            rows = db.session.query(Course.id, Course.title).filter(
+                Course.title.contains(query) | Course.description.contains(query)
+            ).order_by(Course.id).limit(limit)
+            hits += [SearchHit('course', course_id, course_id, title, 0.0) for course_id, title in rows]
+        if not kinds or 'lesson' in kinds:
+            rows = db.session.query(Lesson.id, Lesson.course_id, Lesson.title).filter(
+                Lesson.title.contains(query) | Lesson.content.contains(query)
+            ).order_by(Lesson.id).limit(limit)
+            hits += [SearchHit('lesson', lesson_id, course_id, title, 0.0) for lesson_id, course_id, title in rows]
+        return hits[:limit] if limit else hits
+
+    def snippets(self, query, hits):
+        return content_snippets(query, hits)
+
+    def rebuild(self):
+        return 0
+
+
+class DatabaseBackend:
+    """Shared plumbing for backends that keep a search table in the database"""
+
+    name = None
+    dialect = None
+    schema = ()
+    upsert_sql = None
+    delete_sql = None
+    clear_sql = None
+
+    def __init__(self):
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    def table_exists(self, connection):
+        raise NotImplementedError
+
+    def create_schema(self, connection):
+        """Create the search table, filling it if it was missing"""
+        existed = self.table_exists(connection)
+        for statement in self.schema:
+            connection.execute(text(statement))
+        if not existed:
+            self._fill(connection)
+        self._ready.add(id(connection.engine))
+
+    def ensure_schema(self):
+        """Create the search table once per process, in its own transaction"""
+        if id(db.engine) in self._ready:
+            return
+        with self._lock:
+            if id(db.engine) not in self._ready:
+                with db.engine.begin() as connection:
+                    self.create_schema(connection)
+
+    def is_ready(self, connection):
+        if id(connection.engine) not in self._ready and self.table_exists(connection):
+            self._ready.add(id(connection.engine))
+        return id(connection.engine) in self._ready
+
+    def _fill(self, connection, chunk_size=500):
+        count = 0
+        batch = []
+        for kind, doc_id, course_id, title, body in iter_documents(connection, chunk_size):
+            batch.append(self.row(kind, doc_id, course_id, title, body))
+            if len(batch) >= chunk_size:
+                connection.execute(text(self.upsert_sql), batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            connection.execute(text(self.upsert_sql), batch)
+            count += len(batch)
+        return count
+
+    def row(self, kind, doc_id, course_id, title, body):
+        return {'kind': kind, 'doc_id': doc_id, 'course_id': course_id, 'title': title or '', 'body': body or ''}
+
+    # Until the table exists there is nothing to keep in step; creating it fills it
+    def upsert(self, connection, kind, doc_id, course_id, title, body):
+        if self.is_ready(connection):
+            connection.execute(text(self.upsert_sql), [self.row(kind, doc_id, course_id, title, strip_tags(body))])
+
+    def delete(self, connection, kind, doc_id):
+        if self.is_ready(connection):
+            connection.execute(text(self.delete_sql), self.row(kind, doc_id, None, None, None))
+
+    def rebuild(self):
+        self.ensure_schema()
+        connection = db.session.connection()
+        connection.execute(text(self.clear_sql))
+        count = self._fill(connection)
+        db.session.commit()
+        return count
+
+    def match_query(self, query):
+        raise NotImplementedError
+
+    def search_sql(self, kinds, limit):
+        raise NotImplementedError
+
+    def search(self, query, kinds=None, limit=None):
+        match = self.match_query(query)
+        if not match:
+            return []
+        self.ensure_schema()
+        connection = db.session.connection()
+        params = {'match': match}
+        if kinds:
+            params['kinds'] = list(kinds)
+        if limit:
+            params['limit'] = limit
+        rows = connection.execute(_bind(self.search_sql(kinds, limit), kinds), params)
+        return [SearchHit(kind, doc_id, course_id, title, float(score))
+                for kind, doc_id, course_id, title, score in rows]
+
+    def snippets(self, query, hits):
+        return content_snippets(query, hits)
+
+
+class SqliteFtsBackend(DatabaseBackend):
+    """SQLite FTS5 virtual table ranked with bm25()"""
+
+    name = 'sqlite_fts'
+    dialect = 'sqlite'
+    schema = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+        "kind UNINDEXED, doc_id UNINDEXED, course_id UNINDEXED, title, body, tokenize='unicode61')",
+    )
+    # rowid is derived from (kind, id) so updates and deletes are rowid lookups
+    upsert_sql = ("INSERT OR REPLACE INTO search_fts (rowid, kind, doc_id, course_id, title, body) "
+                  "VALUES (:rowid, :kind, :doc_id, :course_id, :title, :body)")
+    delete_sql = "DELETE FROM search_fts WHERE rowid = :rowid"
+    clear_sql = "DELETE FROM search_fts"
+
+    def table_exists(self, connection):
+        return connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'search_fts'"
+        )).first() is not None
+
+    def row(self, kind, doc_id, course_id, title, body):
+        row = super().row(kind, doc_id, course_id, title, body)
+        row['rowid'] = doc_id * 2 + (kind == 'lesson')
+        return row
+
+    def match_query(self, query):
+        return ' OR '.join(f'"{term}"' for term in dict.fromkeys(tokenize(query)))
+
+    def search_sql(self, kinds, limit):
+        # bm25() is lower-is-better; title matches weigh 3x like the in-process index
+        return ("SELECT kind, doc_id, course_id, title, -bm25(search_fts, 0, 0, 0, 3.0, 1.0) AS score "
+                "FROM search_fts WHERE search_fts MATCH :match" + _kinds_filter(kinds) +
+                " ORDER BY score DESC, kind, doc_id" + (' LIMIT :limit' if limit else ''))
+
+
+class PostgresFtsBackend(DatabaseBackend):
+    """``search_document`` table with a weighted tsvector and a GIN index"""
+
+    name = 'postgres_fts'
+    dialect = 'postgresql'
+    schema = (
+        "CREATE TABLE IF NOT EXISTS search_document ("
+        "kind VARCHAR(10) NOT NULL, doc_id INTEGER NOT NULL, course_id INTEGER, "
+        "title TEXT NOT NULL, body TEXT NOT NULL, "
+        "document tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')"
+        ") STORED, PRIMARY KEY (kind, doc_id))",
+        "CREATE INDEX IF NOT EXISTS ix_search_document_document ON search_document USING GIN (document)",
+    )
+    upsert_sql = ("INSERT INTO search_document (kind, doc_id, course_id, title, body) "
+                  "VALUES (:kind, :doc_id, :course_id, :title, :body) "
+                  "ON CONFLICT (kind, doc_id) DO UPDATE SET "
+                  "course_id = EXCLUDED.course_id, title = EXCLUDED.title, body = EXCLUDED.body")
+    delete_sql = "DELETE FROM search_document WHERE kind = :kind AND doc_id = :doc_id"
+    clear_sql = "DELETE FROM search_document"
+
+    def table_exists(self, connection):
+        return connection.execute(text("SELECT to_regclass('search_document')")).scalar() is not None
+
+    def match_query(self, query):
+        return ' | '.join(dict.fromkeys(tokenize(query)))
+
+    def search_sql(self, kinds, limit):
+        return ("SELECT kind, doc_id, course_id, title, ts_rank_cd(document, query) AS score "
+                "FROM search_document, to_tsquery('english', :match) AS query "
+                "WHERE document @@ query" + _kinds_filter(kinds) +
+                " ORDER BY score DESC, kind, doc_id" + (' LIMIT :limit' if limit else ''))
+
+
+BACKENDS = {backend.name: backend for backend in
+            (IndexBackend, LikeBackend, SqliteFtsBackend, PostgresFtsBackend)}
+_instances = {}
+
+
+def backend_name():
+    if has_app_context():
+        return current_app.config.get('SEARCH_BACKEND') or 'index'
+    return 'index'
+
+
+def get_backend(name=None):
+    name = name or backend_name()
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown search backend: {name}')
+    if name not in _instances:
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
+
+
+def search(query, kinds=None, limit=None):
+    """Ranked ``SearchHit`` list for ``query`` from the configured backend"""
+    return get_backend().search(query, kinds, limit)
+
+
+def snippets(query, hits):
+    """{(kind, id): Snippet} of text around the query's matches for each hit"""
+    return get_backend().snippets(query, hits)
+
+
+def _database_backend(connection):
+    backend = get_backend()
+    if isinstance(backend, DatabaseBackend) and connection.dialect.name == backend.dialect:
+        return backend
+    return None
+
+
+def _document_saved(kind):
+    def listener(mapper, connection, target):
+        backend = _database_backend(connection)
+        if backend is None:
+            return
+        if kind == 'course':
+            backend.upsert(connection, kind, target.id, target.id, target.title, target.description)
+        else:
+            backend.upsert(connection, kind, target.id, target.course_id, target.title, target.content)
+    return listener
+
+
+def _document_deleted(kind):
+    def listener(mapper, connection, target):
+        backend = _database_backend(connection)
+        if backend is not None:
+            backend.delete(connection, kind, target.id)
+    return listener
+
+
+for _model, _kind in ((Course, 'course'), (Lesson, 'lesson')):
+    event.listen(_model, 'after_insert', _document_saved(_kind))
+    event.listen(_model, 'after_update', _document_saved(_kind))
+    event.listen(_model, 'after_delete', _document_deleted(_kind))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_schema(target, connection, **kw):
+    backend = _database_backend(connection)
+    if backend is not None:
+        backend.create_schema(connection)
@@ -0,0 +1,15 @@
+"""Dialect-specific SQL helpers."""
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+
+
+def upsert(model):
+    """An INSERT for ``model`` supporting ``on_conflict_do_nothing``/``on_conflict_do_update``.
+
+    Conflict handling keeps concurrent writers from racing without a
+    savepoint, which pysqlite would commit along with the outer transaction.
+    """
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
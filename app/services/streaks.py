@@ -0,0 +1,127 @@
+"""Daily activity streaks.
+
+Each lesson or quiz event calls ``record_activity``. The first event of a day
+sets that day's bit in the user's ``UserActivity`` bitmap and extends or
+restarts ``User.streak_days`` by comparing against ``User.last_active_on``;
+later events the same day cost nothing. Streaks that lapse are zeroed by the
+nightly ``reset_broken_streaks`` job, and reads treat a lapsed streak as zero
+in the meantime, so no read ever scans history.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.models.user import User, UserActivity
+from app.services.sql import upsert
+
+
+def today():
+    return datetime.utcnow().date()
+
+
+def streak_is_alive(last_active_on, on=None):
+    """A streak survives until the end of the day after its last active day"""
+    if last_active_on is None:
+        return False
+    return last_active_on >= (on or today()) - timedelta(days=1)
+
+
+def record_activity(user, day=None):
+    """Record that the user was active, returning (old_streak, new_streak)"""
+    day = day or today()
+    old_streak = user.streak_days or 0
+    if user.last_active_on == day:
+        return old_streak, old_streak
+
+    # Conditional atomic update: of concurrent first events of the day, one extends the streak
+    db.session.execute(
+        db.update(User)
+        .where(User.id == user.id, db.or_(User.last_active_on.is_(None), User.last_active_on < day))
+        .values(streak_days=db.case((User.last_active_on == day - timedelta(days=1),
+                                     db.func.coalesce(User.streak_days, 0) + 1), else_=1),
+                last_active_on=day,
+                stats_version=db.func.coalesce(User.stats_version, 0) + 1)
+    )
+    streak, last_active_on, stats_version = db.session.query(
+        User.streak_days, User.last_active_on, User.stats_version
+    ).filter(User.id == user.id).one()
+    set_committed_value(user, 'streak_days', streak)
+    set_committed_value(user, 'last_active_on', last_active_on)
+    set_committed_value(user, 'stats_version', stats_version)
+
+    # Setting the same day's bit twice is harmless; only the row creation can race
+    db.session.execute(
+        upsert(UserActivity)
+        .values(user_id=user.id, first_day=day, days=b'')
+        .on_conflict_do_nothing(index_elements=['user_id'])
+    )
+    activity = db.session.query(UserActivity).filter(UserActivity.user_id == user.id).with_for_update().one()
+    activity.mark_active(day)
+    return old_streak, streak or 0
+
+
+def streak_from_bitmap(activity, on=None):
+    """Length of the run of active days ending today or yesterday"""
+    on = on or today()
+    day = on if activity.is_active_on(on) else on - timedelta(days=1)
+    streak = 0
+    while activity.is_active_on(day):
+        streak += 1
+        day -= timedelta(days=1)
+    return streak
+
+
+def reset_broken_streaks(chunk_size=5000, on=None):
+    """Zero the streak of every user who was not active today or yesterday.
+
+    Walks users with a non-zero streak in id order, one chunk per
+    transaction, and writes the resets with an executemany UPDATE.
+    Returns the number of streaks reset.
+    """
+    cutoff = (on or today()) - timedelta(days=1)
+    reset = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(User.id, User.last_active_on).filter(
+            User.id > last_id, User.streak_days > 0
+        ).order_by(User.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = [
+            {'id': user_id, 'streak_days': 0}
+            for user_id, last_active_on in rows
+            if last_active_on is None or last_active_on < cutoff
+        ]
+        if updates:
+            db.session.execute(db.update(User), updates)
+        db.session.commit()
+        reset += len(updates)
+    return reset
+
+
+def rebuild_streaks(chunk_size=1000, on=None):
+    """Recompute streak_days and last_active_on for every user from the bitmaps"""
+    rebuilt = 0
+    last_id = 0
+    while True:
+        logs = UserActivity.query.filter(UserActivity.user_id > last_id).order_by(
+            UserActivity.user_id
+        ).limit(chunk_size).all()
+        if not logs:
+            break
+        last_id = logs[-1].user_id
+        updates = []
+        for activity in logs:
+            active_days = list(activity.iter_active_days())
+            updates.append({
+                'id': activity.user_id,
+                'streak_days': streak_from_bitmap(activity, on),
+                'last_active_on': active_days[-1] if active_days else None,
+            })
+        db.session.execute(db.update(User), updates)
+        db.session.commit()
+        rebuilt += len(updates)
+    return rebuilt
@@ -0,0 +1,175 @@
+"""Search-as-you-type suggestions.
+
+Course and lesson titles, plus the most common terms in course and lesson
+text, are held in a sorted array keyed by normalized text. A prefix lookup is
+a bisect for the matching range; prefixes of up to ``SHORT_PREFIX``
+characters, whose ranges can be large, have their best entries precomputed.
+Titles are also keyed from each later word, so "pow" finds "Solar power".
+
+Titles rank above terms, then by popularity: enrollments for courses,
+completions for lessons and document frequency for terms. The array is
+rebuilt in a background thread when content changes (the search journal
+moves) or every ``SUGGEST_REFRESH_SECONDS``, so lookups never wait on the
+database after the first build.
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, namedtuple
+
+from flask import current_app
+
+from app import db
+from app.models.course import Course, Lesson
+from app.models.user import Enrollment, UserProgress
+from app.services.cache import shared_cache
+from app.services.search import JOURNAL_KEY, tokenize
+from config import Config
+
+SHORT_PREFIX = 2
+MIN_TERM_LENGTH = 3
+
+Suggestion = namedtuple('Suggestion', 'text kind id course_id rank')
+
+
+def normalize(text):
+    return ' '.join(tokenize(text))
+
+
+def _order(entry):
+    return entry[1].rank, -len(entry[1].text)
+
+
+class PrefixIndex:
+    """Sorted (key, suggestion) array with precomputed results for short prefixes"""
+
+    def __init__(self, entries, version=None, owner=None, top_k=None):
+        top_k = top_k or Config.SUGGEST_MAX_RESULTS
+        entries = sorted(entries, key=lambda entry: entry[0])
+        self.keys = [key for key, _ in entries]
+        self.entries = [suggestion for _, suggestion in entries]
+        self.version = version
+        self.owner = owner
+        self.built_at = time.monotonic()
+
+        by_prefix = {}
+        for entry in entries:
+            key = entry[0]
+            for n in range(1, min(SHORT_PREFIX, len(key)) + 1):
+                by_prefix.setdefault(key[:n], []).append(entry)
+        # Over-fetch so duplicates of one title keyed from several words can be dropped
+        self.top = {prefix: [suggestion for _, suggestion in heapq.nlargest(top_k * 4, group, key=_order)]
+                    for prefix, group in by_prefix.items()}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, prefix, limit=10):
+        key = normalize(prefix)
+        if not key:
+            return []
+        if prefix[-1:].isspace():
+            key += ' '  # the last word is complete
+        if len(key) <= SHORT_PREFIX:
+            candidates = self.top.get(key, ())
+        else:
+            lo = bisect_left(self.keys, key)
+            hi = bisect_left(self.keys, key + '\uffff', lo)
+            candidates = [suggestion for _, suggestion in heapq.nlargest(
+                limit * 4, zip(self.keys[lo:hi], self.entries[lo:hi]), key=_order
+            )]
+
+        results, seen = [], set()
+        for suggestion in candidates:
+            identity = (suggestion.kind, suggestion.id if suggestion.kind != 'term' else suggestion.text)
+            if identity in seen:
+                continue
+            seen.add(identity)
+            results.append(suggestion)
+            if len(results) == limit:
+                break
+        return results
+
+
+def _title_entries(suggestion):
+    """One key per word start, so a title matches from any of its words"""
+    words = normalize(suggestion.text).split()
+    return [(' '.join(words[i:]), suggestion) for i in range(len(words))]
+
+
+def build_suggestions(version=None, max_terms=None):
+    """Build the prefix index from course and lesson titles and text"""
+    max_terms = max_terms or Config.SUGGEST_MAX_TERMS
+    enrollments = dict(
+        db.session.query(Enrollment.course_id, db.func.count(Enrollment.id)).group_by(Enrollment.course_id)
+    )
+    completions = dict(
+        db.session.query(UserProgress.lesson_id, db.func.count(UserProgress.id))
+        .filter(UserProgress.completed.is_(True)).group_by(UserProgress.lesson_id)
+    )
+
+    entries = []
+    document_frequency = Counter()
+    for course_id, title, description in db.session.query(
+        Course.id, Course.title, Course.description
+    ).yield_per(500):
+        entries += _title_entries(Suggestion(title, 'course', course_id, course_id,
+                                             (1, enrollments.get(course_id, 0))))
+        document_frequency.update(set(tokenize(title)) | set(tokenize(description)))
+    for lesson_id, course_id, title, content in db.session.query(
+        Lesson.id, Lesson.course_id, Lesson.title, Lesson.content
+    ).yield_per(500):
+        entries += _title_entries(Suggestion(title, 'lesson', lesson_id, course_id,
+                                             (1, completions.get(lesson_id, 0))))
+        document_frequency.update(set(tokenize(title)) | set(tokenize(content)))
+
+    terms = ((term, count) for term, count in document_frequency.items()
+             if len(term) >= MIN_TERM_LENGTH and not term.isdigit())
+    for term, count in heapq.nlargest(max_terms, terms, key=lambda item: item[1]):
+        entries.append((term, Suggestion(term, 'term', None, None, (0, count))))
+
+    return PrefixIndex(entries, version, id(db.engine))
+
+
+_suggestions = None
+_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+def _refresh(app, version):
+    global _suggestions
+    try:
+        with app.app_context():
+            index = build_suggestions(version)
+            db.session.remove()
+        _suggestions = index
+    finally:
+        _refreshing.clear()
+
+
+def get_suggestion_index():
+    """Current index; stale copies keep serving while a rebuild runs in the background"""
+    global _suggestions
+    version = shared_cache.get_version(JOURNAL_KEY)
+    index = _suggestions
+    if index is None or index.owner != id(db.engine):
+        with _lock:
+            if _suggestions is None or _suggestions.owner != id(db.engine):
+                _suggestions = build_suggestions(version)
+            return _suggestions
+
+    stale = (index.version != version
+             or time.monotonic() - index.built_at >= Config.SUGGEST_REFRESH_SECONDS)
+    if stale and not _refreshing.is_set():
+        with _lock:
+            if not _refreshing.is_set():
+                _refreshing.set()
+                threading.Thread(target=_refresh, args=(current_app._get_current_object(), version),
+                                 name='suggest-refresh', daemon=True).start()
+    return index
+
+
+def suggest(prefix, limit=8):
+    return get_suggestion_index().lookup(prefix, limit)
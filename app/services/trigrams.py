@@ -0,0 +1,75 @@
+"""Character-trigram index for typo-tolerant term matching.
+
+Each term is padded (``"  term "``) and split into its character trigrams,
+and every trigram maps to the set of terms containing it. Candidates for a
+misspelled term are counted from the posting sets of its own trigrams, so a
+lookup touches only those sets, never the whole vocabulary, and similarity
+is the share of trigrams two terms have in common (as in ``pg_trgm``).
+"""
+
+from collections import Counter
+
+
+def trigrams(term):
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Jaccard similarity of two terms' trigram sets"""
+    a, b = trigrams(a), trigrams(b)
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class TrigramIndex:
+    """Trigram -> {terms} postings over a changing vocabulary"""
+
+    def __init__(self):
+        self.postings = {}
+        self.sizes = {}  # term -> number of distinct trigrams
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __contains__(self, term):
+        return term in self.sizes
+
+    def add(self, term):
+        if term in self.sizes:
+            return
+        grams = trigrams(term)
+        self.sizes[term] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(term)
+
+    def remove(self, term):
+        if self.sizes.pop(term, None) is None:
+            return
+        for gram in trigrams(term):
+            terms = self.postings[gram]
+            terms.discard(term)
+            if not terms:
+                del self.postings[gram]
+
+    def similar(self, term, threshold=0.3, limit=None):
+        """(term, similarity) pairs at or above the threshold, most similar first"""
+        grams = trigrams(term)
+        size = len(grams)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        # Jaccard >= threshold needs the candidate's trigram count within [t * n, n / t];
+        # a zero threshold bounds nothing, so every candidate sharing a trigram matches
+        low, high = threshold * size, size / threshold if threshold > 0 else float('inf')
+        matches = []
+        for candidate, count in shared.items():
+            candidate_size = self.sizes[candidate]
+            if not low <= candidate_size <= high:
+                continue
+            score = count / (size + candidate_size - count)
+            if score >= threshold:
+                matches.append((candidate, score))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit] if limit else matches
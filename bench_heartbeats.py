@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Benchmark lesson heartbeats: one write per beat vs the buffered writer.
+
+Runs heartbeat senders and progress readers side by side against a file
+SQLite database and reports heartbeats and reads per second for a growing
+number of concurrent readers.
+
+    python bench_heartbeats.py [--seconds 3] [--senders 4] [--readers 1,4,16,32]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from app import create_app, db
+from app.models.user import User, UserProgress
+from app.services.heartbeats import HeartbeatBuffer
+from config import Config
+
+USERS = 200
+LESSONS = 20
+
+
+class BenchConfig(Config):
+    SECRET_KEY = 'bench'
+
+
+def seed():
+    db.create_all()
+    db.session.execute(db.insert(User), [
+        {'username': f'u{i}', 'email': f'u{i}@example.com', 'password_hash': 'x',
+         'first_name': 'Bench', 'last_name': str(i)}
+        for i in range(USERS)
+    ])
+    db.session.execute(db.insert(UserProgress), [
+        {'user_id': user_id, 'lesson_id': lesson_id, 'time_spent': 0}
+        for user_id in range(1, USERS + 1) for lesson_id in range(1, LESSONS + 1)
+    ])
+    db.session.commit()
+
+
+def direct_heartbeat(user_id, lesson_id, seconds):
+    db.session.query(UserProgress).filter_by(user_id=user_id, lesson_id=lesson_id).update(
+        {UserProgress.time_spent: UserProgress.time_spent + seconds}
+    )
+    db.session.commit()
+
+
+def run(app, mode, senders, readers, seconds):
+    stop = threading.Event()
+    counts = {'beats': 0, 'reads': 0, 'errors': 0}
+    lock = threading.Lock()
+    buffer = HeartbeatBuffer(flush_size=Config.HEARTBEAT_FLUSH_SIZE, flush_seconds=1)
+
+    def count(key, n=1):
+        with lock:
+            counts[key] += n
+
+    def sender():
+        with app.app_context():
+            while not stop.is_set():
+                user_id, lesson_id = random.randint(1, USERS), random.randint(1, LESSONS)
+                try:
+                    if mode == 'direct':
+                        direct_heartbeat(user_id, lesson_id, 5)
+                    else:
+                        buffer.add(user_id, lesson_id, 5)
+                    count('beats')
+                except Exception:
+                    db.session.rollback()
+                    count('errors')
+
+    def reader():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    db.session.query(UserProgress).filter_by(user_id=random.randint(1, USERS)).all()
+                    db.session.rollback()
+                    count('reads')
+                except Exception:
+                    db.session.rollback()
+                    count('errors')
+
+    threads = [threading.Thread(target=sender) for _ in range(senders)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        buffer.flush()
+    return {key: value / seconds for key, value in counts.items()}, buffer.flushes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--senders', type=int, default=4)
+    parser.add_argument('--readers', default='1,4,16,32')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        BenchConfig.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        BenchConfig.SHARED_CACHE_PATH = os.path.join(tmp, 'cache.sqlite')
+        app = create_app(BenchConfig)
+        with app.app_context():
+            seed()
+
+        print(f"{'mode':<9}{'readers':>8}{'beats/s':>12}{'reads/s':>12}{'errors/s':>10}{'flushes':>9}")
+        for readers in (int(n) for n in args.readers.split(',')):
+            for mode in ('direct', 'buffered'):
+                rates, flushes = run(app, mode, args.senders, readers, args.seconds)
+                print(f"{mode:<9}{readers:>8}{rates['beats']:>12.0f}{rates['reads']:>12.0f}"
+                      f"{rates['errors']:>10.1f}{flushes if mode == 'buffered' else '-':>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,44 @@ class Config:
     POINTS_PER_LESSON = 100
     POINTS_PER_QUIZ = 150
     POINTS_PER_CHALLENGE = 200
+    POINTS_PER_COURSE = 500
+    QUIZ_PASS_PERCENTAGE = 60
+    
+    # Points needed to reach each level; level N starts at LEVEL_THRESHOLDS[N - 1]
+    LEVEL_THRESHOLDS = [0, 100, 500, 1500, 3000]
+    
+    # Leaderboard rank index (per worker, re-synced against the database)
+    RANK_INDEX_RECONCILE_SECONDS = int(os.environ.get('RANK_INDEX_RECONCILE_SECONDS') or 30)
+    
+    # Cache shared by all workers on a host (SQLite file)
+    SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH') or \
+        os.path.join(basedir, 'instance', 'shared_cache.sqlite')
+    LEADERBOARD_CACHE_TTL = int(os.environ.get('LEADERBOARD_CACHE_TTL') or 60)
+    OUTLINE_CACHE_TTL = int(os.environ.get('OUTLINE_CACHE_TTL') or 3600)
+    ENROLLMENT_CACHE_TTL = int(os.environ.get('ENROLLMENT_CACHE_TTL') or 300)
+    
+    # Lesson time tracking: buffered heartbeats are written in batches
+    HEARTBEAT_FLUSH_SIZE = int(os.environ.get('HEARTBEAT_FLUSH_SIZE') or 500)
+    HEARTBEAT_FLUSH_SECONDS = int(os.environ.get('HEARTBEAT_FLUSH_SECONDS') or 10)
+    HEARTBEAT_MAX_SECONDS = 60  # most time a single heartbeat can report
+    
+    # Course and lesson search: index (in-process), sqlite_fts, postgres_fts or like
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'index'
+    # In-process index (per worker, loaded from a snapshot)
+    SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH') or \
+        os.path.join(basedir, 'instance', 'search_index.json.gz')
+    SEARCH_JOURNAL_TTL = 86400  # how long content change entries are kept for other workers
+    SEARCH_JOURNAL_MAX_REPLAY = 1000  # rebuild instead when further behind than this
+    SEARCH_JOURNAL_WAIT_SECONDS = 5  # how long a missing entry may still be in flight
+    # Typo tolerance: unknown query terms match indexed terms this similar (trigram overlap)
+    SEARCH_FUZZY_THRESHOLD = float(os.environ.get('SEARCH_FUZZY_THRESHOLD') or 0.3)
+    SEARCH_FUZZY_MAX_EXPANSIONS = 3  # similar terms searched per misspelled term
+    
+    # Search-as-you-type suggestions (per worker, rebuilt in the background)
+    SUGGEST_MAX_RESULTS = 10
+    SUGGEST_MAX_TERMS = int(os.environ.get('SUGGEST_MAX_TERMS') or 20000)
+    SUGGEST_REFRESH_SECONDS = int(os.environ.get('SUGGEST_REFRESH_SECONDS') or 300)
+    SUGGEST_CACHE_SECONDS = 60  # Cache-Control max-age on /api/suggest responses
     
     @staticmethod
     def init_app(app):
@@ -57,6 +95,8 @@ class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SHARED_CACHE_PATH = ':memory:'
+    SEARCH_INDEX_PATH = None
     WTF_CSRF_ENABLED = False
 
 config = {
@@ -14,11 +14,11 @@ def init_sample_data():
     
     # Create achievements
     achievements = [
-        Achievement(name="First Steps", description="Complete your first lesson", icon="fa-baby-carriage"),
-        Achievement(name="Knowledge Seeker", description="Earn 500 points", icon="fa-book"),
-        Achievement(name="Eco Warrior", description="Earn 1000 points", icon="fa-shield-alt"),
-        Achievement(name="Environmental Expert", description="Earn 2500 points", icon="fa-graduation-cap"),
-        Achievement(name="Green Champion", description="Complete 5 courses", icon="fa-trophy"),
+        Achievement(name="First Steps", description="Complete your first lesson", icon="fa-baby-carriage", criteria_metric="lessons_completed", criteria_threshold=1),
+        Achievement(name="Knowledge Seeker", description="Earn 500 points", icon="fa-book", criteria_metric="points", criteria_threshold=500),
+        Achievement(name="Eco Warrior", description="Earn 1000 points", icon="fa-shield-alt", criteria_metric="points", criteria_threshold=1000),
+        Achievement(name="Environmental Expert", description="Earn 2500 points", icon="fa-graduation-cap", criteria_metric="points", criteria_threshold=2500),
+        Achievement(name="Green Champion", description="Complete 5 courses", icon="fa-trophy", criteria_metric="courses_completed", criteria_threshold=5),
     ]
     
     for achievement in achievements:
@@ -9,6 +9,7 @@ document.addEventListener('DOMContentLoaded', function() {
     initializeProgressBars();
     initializeGamification();
     initializeTooltips();
+    initializeLessonHeartbeat();
 });
 
 function initializeApp() {
@@ -242,7 +243,10 @@ function updateLessonProgress(lessonId, completed = true) {
             }
             
             // Show points earned
-            if (data.points_earned > 0) {
+            if (data.course_completed) {
+                showAlert(`Course completed! You earned ${data.points_earned} points.`, 'success');
+                updatePoints(data.points_earned);
+            } else if (data.points_earned > 0) {
                 showAlert(`Lesson completed! You earned ${data.points_earned} points.`, 'success');
                 updatePoints(data.points_earned);
             }
@@ -258,6 +262,47 @@ function updateLessonProgress(lessonId, completed = true) {
     });
 }
 
+// Lesson time tracking: report time spent while the lesson tab is visible
+function initializeLessonHeartbeat(intervalSeconds = 15) {
+    const lessonContent = document.querySelector('.lesson-content[data-lesson-id]');
+    if (!lessonContent) return;
+    
+    const lessonId = lessonContent.dataset.lessonId;
+    let lastBeat = Date.now();
+    
+    function sendHeartbeat() {
+        const now = Date.now();
+        const seconds = Math.round((now - lastBeat) / 1000);
+        lastBeat = now;
+        if (seconds <= 0) return;
+        
+        fetch(`/api/lesson/${lessonId}/heartbeat`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({seconds: seconds}),
+            keepalive: true
+        }).catch(error => {
+            console.error('Error sending heartbeat:', error);
+        });
+    }
+    
+    setInterval(() => {
+        if (document.visibilityState === 'visible') {
+            sendHeartbeat();
+        } else {
+            lastBeat = Date.now();
+        }
+    }, intervalSeconds * 1000);
+    
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') {
+            sendHeartbeat();
+        } else {
+            lastBeat = Date.now();
+        }
+    });
+}
+
 function showAchievementModal(achievements) {
     const modalHtml = `
         <div class="modal fade" id="achievementModal" tabindex="-1">
@@ -295,7 +340,7 @@ function showAchievementModal(achievements) {
     });
 }
 
-// Search functionality
+// Search functionality: suggestions while typing, full search on Enter
 function initializeSearch() {
     const searchInput = document.getElementById('search-input');
     const searchResults = document.getElementById('search-results');
@@ -304,22 +349,60 @@ function initializeSearch() {
         let searchTimeout;
         
         searchInput.addEventListener('input', function() {
-            const query = this.value.trim();
+            const query = this.value;
             
             clearTimeout(searchTimeout);
             
-            if (query.length < 2) {
+            if (query.trim().length < 1) {
                 searchResults.innerHTML = '';
                 return;
             }
             
             searchTimeout = setTimeout(() => {
-                performSearch(query);
-            }, 300);
+                performSuggest(query);
+            }, 150);
+        });
+        
+        searchInput.addEventListener('keydown', function(event) {
+            if (event.key === 'Enter' && this.value.trim().length >= 2) {
+                event.preventDefault();
+                clearTimeout(searchTimeout);
+                performSearch(this.value.trim());
+            }
         });
     }
 }
 
+const suggestCache = new Map();
+
+function performSuggest(query) {
+    if (suggestCache.has(query)) {
+        displaySuggestions(suggestCache.get(query));
+        return;
+    }
+    
+    fetch(`/api/suggest?q=${encodeURIComponent(query)}`)
+    .then(response => response.json())
+    .then(data => {
+        suggestCache.set(query, data.suggestions);
+        displaySuggestions(data.suggestions);
+    })
+    .catch(error => {
+        console.error('Suggest error:', error);
+    });
+}
+
+function displaySuggestions(suggestions) {
+    const searchResults = document.getElementById('search-results');
+    const icons = {course: 'fa-book-open', lesson: 'fa-file-alt', term: 'fa-search'};
+    
+    searchResults.innerHTML = suggestions.map(suggestion => `
+        <a class="d-block py-1" href="${escapeHtml(suggestion.url)}">
+            <i class="fas ${icons[suggestion.type]} me-2 text-muted"></i>${escapeHtml(suggestion.text)}
+        </a>
+    `).join('');
+}
+
 function performSearch(query) {
     fetch(`/api/search?q=${encodeURIComponent(query)}`, {
         method: 'GET',
@@ -346,15 +429,32 @@ function displaySearchResults(results) {
     
     const resultsHtml = results.map(result => `
         <div class="search-result-item border-bottom pb-2 mb-2">
-            <h6><a href="${result.url}">${result.title}</a></h6>
-            <p class="text-muted mb-0">${result.description}</p>
+            <h6><a href="${escapeHtml(result.url)}">${escapeHtml(result.title)}</a></h6>
+            <p class="text-muted mb-0">${highlightText(result.description, result.highlights)}</p>
         </div>
     `).join('');
     
     searchResults.innerHTML = resultsHtml;
 }
 
+// Wrap the [start, end] spans of a snippet in <mark>, escaping everything else
+function highlightText(text, highlights) {
+    let html = '';
+    let position = 0;
+    
+    (highlights || []).forEach(([start, end]) => {
+        html += escapeHtml(text.slice(position, start)) + `<mark>${escapeHtml(text.slice(start, end))}</mark>`;
+        position = end;
+    });
+    
+    return html + escapeHtml(text.slice(position));
+}
+
 // Utility functions
+function escapeHtml(value) {
+    return String(value).replace(/[&<>"']/g, char => `&#${char.charCodeAt(0)};`);
+}
+
 function formatDuration(seconds) {
     const hours = Math.floor(seconds / 3600);
     const minutes = Math.floor((seconds % 3600) / 60);
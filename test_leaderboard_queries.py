@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Check the leaderboard page costs the same number of queries for any board size"""
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models.user import User
+from app.models.gamification import Achievement, UserAchievement
+from app.services.cache import shared_cache
+from app.services.leaderboard import rank_index
+from config import TestingConfig
+
+
+def count_leaderboard_queries(user_count):
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        achievement = Achievement(name='Tester', description='Test achievement')
+        db.session.add(achievement)
+        users = [
+            User(username=f'user{i}', email=f'user{i}@example.com',
+                 first_name='Test', last_name=f'User{i}', total_points=i * 10)
+            for i in range(user_count)
+        ]
+        users[0].set_password('password')
+        for user in users:
+            user.password_hash = users[0].password_hash
+        db.session.add_all(users)
+        db.session.commit()
+        db.session.add_all([UserAchievement(user_id=user.id, achievement_id=achievement.id) for user in users])
+        db.session.commit()
+
+        rank_index.rebuild()
+        shared_cache.clear()
+        engine = db.engine
+
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'user0', 'password': 'password'})
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get('/gamification/leaderboard')
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    assert response.data.count(b'class="badge bg-warning">1<') == user_count
+    return len(statements)
+
+
+def test_leaderboard_query_count_is_constant():
+    small = count_leaderboard_queries(5)
+    assert small <= 3
+    assert count_leaderboard_queries(50) == small
+
+
+if __name__ == "__main__":
+    small, large = count_leaderboard_queries(5), count_leaderboard_queries(50)
+    print(f"5 users: {small} queries, 50 users: {large} queries")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Check a lesson completed twice is only counted and rewarded once"""
+
+from app import create_app, db
+from app.models.course import Course, Lesson
+from app.models.user import Enrollment, User
+from app.services.progress import mark_lesson_completed
+from config import Config, TestingConfig
+
+
+def create_course_app():
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        user = User(username='student', email='student@example.com', first_name='Test', last_name='Student')
+        user.set_password('password')
+        db.session.add_all([user, Course(title='Short course', description='Three lessons')])
+        db.session.commit()
+        db.session.add_all([Lesson(course_id=1, title=f'Lesson {i}', content='Content', order=i) for i in range(3)])
+        db.session.add(Enrollment(user_id=user.id, course_id=1, total_lessons=3))
+        db.session.commit()
+    return app
+
+
+def counters(app):
+    with app.app_context():
+        user = db.session.get(User, 1)
+        enrollment = Enrollment.query.filter_by(user_id=1, course_id=1).one()
+        return user.total_points, user.lessons_completed, enrollment.completed_lessons, enrollment.is_completed
+
+
+def test_completion_is_counted_once():
+    app = create_course_app()
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'student', 'password': 'password'})
+
+    client.post('/courses/1/lessons/1/complete')
+    client.post('/courses/1/lessons/1/complete')
+    response = client.post('/api/lesson/1/progress', json={'completed': True})
+    assert response.json['points_earned'] == 0
+    assert counters(app) == (Config.POINTS_PER_LESSON, 1, 1, False)
+
+
+def test_only_one_concurrent_completion_flips_the_flag():
+    app = create_course_app()
+    with app.app_context():
+        # A request that read completed=False before another committed still cannot flip it again
+        assert mark_lesson_completed(1, 2)[1] is True
+        assert mark_lesson_completed(1, 2)[1] is False
+        progress, _ = mark_lesson_completed(1, 2)
+        assert progress.completed and progress.completed_at is not None
+
+
+if __name__ == "__main__":
+    test_completion_is_counted_once()
+    test_only_one_concurrent_completion_flips_the_flag()
+    print("Lesson completions are counted once")
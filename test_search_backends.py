@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Check every search backend finds the same documents as the LIKE reference"""
+
+from app import create_app, db
+from app.models.course import Course, Lesson
+from app.services.search import InvertedIndex
+from app.services.search_backends import get_backend
+from config import TestingConfig
+
+COURSES = [
+    ('Solar power basics', 'Harness the <b>sun</b> for clean energy'),
+    ('Wind energy', 'Turbines, wind farms and the grid'),
+    ('Ocean life', 'Coral reefs and marine ecosystems'),
+]
+LESSONS = [
+    (1, 'Photovoltaics', '<p>Solar cells turn sunlight into electricity.</p>'),
+    (1, 'Storing energy', 'Batteries keep solar power for the night'),
+    (2, 'Offshore turbines', 'Wind is stronger at sea'),
+    (3, 'Reef bleaching', 'Warm water stresses coral'),
+]
+QUERIES = ['solar', 'energy', 'wind', 'coral', 'turbines', 'batteries', 'nothing']
+MISSPELLED = {'photovoltaic': 'photovoltaics', 'electrcity': 'electricity', 'batteris': 'batteries'}
+
+
+def search_results(backend_name, queries=QUERIES):
+    class Config(TestingConfig):
+        SEARCH_BACKEND = backend_name
+
+    app = create_app(Config)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Course(title=title, description=description) for title, description in COURSES])
+        db.session.commit()
+        db.session.add_all([Lesson(course_id=course_id, title=title, content=content)
+                            for course_id, title, content in LESSONS])
+        db.session.commit()
+
+        # Edits and deletes must reach the backend too
+        Lesson.query.filter_by(title='Reef bleaching').one().content = 'Warm water stresses coral polyps'
+        db.session.delete(Lesson.query.filter_by(title='Offshore turbines').one())
+        db.session.commit()
+
+        backend = get_backend()
+        return {query: {(hit.kind, hit.id) for hit in backend.search(query)} for query in queries}
+
+
+def test_backends_match_like_reference():
+    reference = search_results('like')
+    assert reference['solar'] == {('course', 1), ('lesson', 1), ('lesson', 2)}
+    for backend_name in ('index', 'sqlite_fts'):
+        assert search_results(backend_name) == reference, backend_name
+
+
+def test_index_tolerates_misspellings():
+    fuzzy = search_results('index', list(MISSPELLED))
+    exact = search_results('index', list(MISSPELLED.values()))
+    for misspelled, correct in MISSPELLED.items():
+        assert fuzzy[misspelled] == exact[correct] != set(), misspelled
+
+
+def test_snippets_highlight_matches():
+    index = InvertedIndex()
+    filler = ' '.join(f'filler{i}' for i in range(50))
+    index.add('lesson', 1, 1, 'Photovoltaics', f'<p>{filler} Solar cells turn <b>sunlight</b> into power. {filler}</p>')
+    snippet = index.snippets('sunlight cells', index.search('sunlight cells'))[('lesson', 1)]
+    assert snippet.text.startswith('...') and snippet.text.endswith('...')
+    assert [snippet.text[start:end] for start, end in snippet.highlights] == ['cells', 'sunlight']
+
+
+def test_snippet_for_term_longer_than_window():
+    index = InvertedIndex()
+    long_term = 'x' * 200
+    index.add('lesson', 1, 1, 'Long', f'Some intro text {long_term} and then solar panels')
+    snippet = index.snippets(f'{long_term} solar', index.search(f'{long_term} solar'))[('lesson', 1)]
+    assert snippet.text.startswith('...' + 'x' * 150)
+    assert [snippet.text[start:end] for start, end in snippet.highlights] == ['x' * 150]
+
+
+if __name__ == "__main__":
+    test_backends_match_like_reference()
+    test_index_tolerates_misspellings()
+    test_snippets_highlight_matches()
+    test_snippet_for_term_longer_than_window()
+    print("All backends match the LIKE reference")